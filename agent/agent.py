@@ -4,12 +4,19 @@ from tools.cypher_search import CypherSearch
 from tools.embed_search import EmbedSearch
 from tools.pubmed_search import PubmedSearch
 from tools.semmed_search import SemmedSearch
+from helpers.cypher import NAME_STORE_QUERIES
+from helpers.context import ContextBuilder
 from drivers.neo4j_drive import connect_neo4j
+from agent.session import Session, SessionStore
 
 
+from agent.memory import ConversationMemory, Turn
 from langchain_core.prompts import ChatPromptTemplate
-from typing import Optional, Any, Literal
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import aclosing, closing
+from typing import Optional, Any, AsyncIterator, Iterator, Literal
 from pydantic import BaseModel
+import asyncio
 import json
 
 class Message:
@@ -18,11 +25,6 @@ class Message:
     self.tool = tool_used
     self.answer = generated_answer
 
-class State:
-  def __init__(self):
-    self.past_messages: str = ""
-    self.performance_history = []
-
 class Decision(BaseModel):
   tool: str
   tool_parameters: dict[str, Any]
@@ -37,30 +39,39 @@ class Agent:
                tool_names: list[str] = ["cypher_search", "embed_search", "pubmed_search", "semmed_search"],
                vector_stores: list[str] = ["host", "pathogen", "vaccine"],
                debug: bool = False,
-               self_critic: bool = False): 
+               self_critic: bool = False,
+               context_budget: int = 6000,
+               max_sessions: int = 1000,
+               session_ttl: Optional[float] = 3600,
+               session_memory: int = 64 * 1024 * 1024,
+               memory_budget: int = 1500,
+               async_drivers: bool = False): 
     self.name = name
     self.email = email
     self.answer_model = create_llm(llm_model)
     self.tool_names = tool_names
     self.neo4j_driver = connect_neo4j()
-    self.state = State()
     self.debug = debug
     self.tools: dict[str, Tool] = {}
-    self.retrieved_data: str = ""
-    self.retrieval_count: int = 0
-    self.tool_success: list[str] = []
-    self.notes: str = ""
+    self.helper_model = create_llm(helper_model)
+    #old turns are summarized in the background so answers never wait on it
+    self.summary_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="memory-summary")
+    #conversation state is per session, everything else on the agent is shared by all sessions
+    self.sessions = SessionStore(max_sessions, session_ttl, session_memory,
+                                 lambda: ConversationMemory(memory_budget, summarize=self._summarize_turns, executor=self.summary_executor))
     self.self_critic: bool = self_critic
+    self.context_builder = ContextBuilder(context_budget)
     
     for tool in tool_names:
       if tool == "cypher_search":
-        self.tools["cypher_search"] = CypherSearch(self.debug, vector_stores, ["MATCH (n: HostName) return n.NAME", "MATCH (n: PathogenName) return n.NAME", "MATCH (n: VaccineName) return n.NAME"], [])
+        self.tools["cypher_search"] = CypherSearch(self.debug, vector_stores, [NAME_STORE_QUERIES[name] for name in vector_stores], [], 
+                                                   async_drivers)
       elif tool == "embed_search":
         self.tools["embed_search"] = EmbedSearch(self.debug)
       elif tool == "pubmed_search":
         self.tools["pubmed_search"] = PubmedSearch(self.email, self.debug)
       elif tool == "semmed_search":
-        self.tools["semmed_search"] = SemmedSearch(self.debug)
+        self.tools["semmed_search"] = SemmedSearch(self.debug, async_driver=async_drivers)
       else:
         raise ValueError
   
@@ -70,17 +81,43 @@ class Agent:
     if decision:
       return self.tools[decision].execute(prompt)
   """
-  def answer(self, user_query: str) -> str:
-    state_update_str = f"User query: {user_query}\n"
-    self.retrieved_data = ""
+  def answer(self, user_query: str, session_id: str = "default") -> str:
+    #closing the stream runs its finally (session lock released, session saved) before returning
+    with closing(self.answer_stream(user_query, session_id)) as events:
+      for event in events:
+        if event["type"] == "done":
+          return event["answer"]
+    raise ValueError("in answer, expected a done event from answer_stream but the stream ended")
+
+  async def aanswer(self, user_query: str, session_id: str = "default") -> str:
+    async with aclosing(self.aanswer_stream(user_query, session_id)) as events:
+      async for event in events:
+        if event["type"] == "done":
+          return event["answer"]
+    raise ValueError("in aanswer, expected a done event from aanswer_stream but the stream ended")
+
+  def answer_stream(self, user_query: str, session_id: str = "default") -> Iterator[dict[str, Any]]:
+    """answers the user query as a stream of events: tool (the decided tool), retrieval (after each retrieval round),
+    token (final answer chunks as the model generates them) and done (the full answer)"""
+    session = self.sessions.get(session_id)
+    with session.lock:
+      try:
+        yield from self._answer_events(user_query, session)
+      finally:
+        session.retrieved_data = []
+        self.sessions.save(session)
+
+  def _answer_events(self, user_query: str, session: Session) -> Iterator[dict[str, Any]]:
+    session.retrieved_data = []
     retrieved = ""
     tool = ""
     
     if self.self_critic:
-      while self.retrieval_count == 0 or self._self_evaluate(user_query, retrieved):
-        print(self.retrieval_count)
-        decision = self._decide(user_query)
+      while session.retrieval_count == 0 or self._self_evaluate(user_query, retrieved, session):
+        print(session.retrieval_count)
+        decision = self._decide(user_query, session)
         tool = decision.tool
+        yield {"type": "tool", "tool": tool, "parameters": decision.tool_parameters}
         if tool == "cypher_search":
           retrieved = self.tools["cypher_search"].execute(user_query=user_query)
         elif tool == "embedded_search":
@@ -90,22 +127,25 @@ class Agent:
             retrieved = self.tools["pubmed_search"].execute(user_query=decision.tool_parameters["query"], number_to_retrieve=decision.tool_parameters["number"], type=decision.tool_parameters["type"])
           except:
             retrieved = ""
-            self.notes += "no pmcids were found for the pubmed ids, retry with different ones, maybe try abstract or higher k"
+            session.notes += "no pmcids were found for the pubmed ids, retry with different ones, maybe try abstract or higher k"
         elif tool == "semmed_search":
           retrieved = self.tools["semmed_search"].execute(user_query=user_query, k=decision.tool_parameters["k"])
         elif tool == "conversation":
           final_answer = decision.tool_parameters["message"]
-          state_update_str += f"Answer: {final_answer}\n"
-          self.state.past_messages += state_update_str
-          return final_answer
+          session.state.memory.add_turn(user_query, final_answer)
+          yield {"type": "token", "content": final_answer}
+          yield {"type": "done", "answer": final_answer}
+          return
         else: 
           raise ValueError(f"in answer, expected valid tool selection ['cypher_search', 'embed_search', 'pubmed_search', 'semmed_search'] but got {tool}")
-        self.retrieval_count += 1
-      self.tool_success = [] 
-      self.retrieval_count = 0
+        session.retrieval_count += 1
+        yield {"type": "retrieval", "tool": tool, "round": session.retrieval_count, "found": bool(retrieved)}
+      session.tool_success = [] 
+      session.retrieval_count = 0
     else:
-      decision = self._decide(user_query)
+      decision = self._decide(user_query, session)
       tool = decision.tool
+      yield {"type": "tool", "tool": tool, "parameters": decision.tool_parameters}
       if tool == "cypher_search":
         retrieved = self.tools["cypher_search"].execute(user_query=user_query)
       elif tool == "embedded_search":
@@ -114,23 +154,122 @@ class Agent:
         try:
           retrieved = self.tools["pubmed_search"].execute(user_query=decision.tool_parameters["query"], number_to_retrieve=decision.tool_parameters["number"], type=decision.tool_parameters["type"])
         except:
-          self.retrieval_count += 1
+          session.retrieval_count += 1
       elif tool == "semmed_search":
         retrieved = self.tools["semmed_search"].execute(user_query=user_query, k=decision.tool_parameters["k"])
       elif tool == "conversation":
         final_answer = decision.tool_parameters["message"]
-        state_update_str += f"Answer: {final_answer}\n"
-        self.state.past_messages += state_update_str
-        return final_answer
-      self.retrieved_data += str(retrieved)
-    final_answer = self._final_answer(user_query, self.retrieved_data, tool)
+        session.state.memory.add_turn(user_query, final_answer)
+        yield {"type": "token", "content": final_answer}
+        yield {"type": "done", "answer": final_answer}
+        return
+      session.retrieved_data.append(retrieved)
+      yield {"type": "retrieval", "tool": tool, "round": 1, "found": bool(retrieved)}
+    
+    chunks = []
+    for chunk in self._final_answer_stream(user_query, session.retrieved_data, tool):
+      chunks.append(chunk)
+      yield {"type": "token", "content": chunk}
+    final_answer = "".join(chunks)
+    if self.debug:
+      print(final_answer)
+    
+    session.state.memory.add_turn(user_query, final_answer)
+    
+    yield {"type": "done", "answer": final_answer}
+
+  async def aanswer_stream(self, user_query: str, session_id: str = "default") -> AsyncIterator[dict[str, Any]]:
+    """answer_stream for the asyncio serving path, llm calls, neo4j queries and NCBI requests are awaited so concurrent
+    chats overlap their network waits"""
+    session = self.sessions.get(session_id)
+    async with session.alock:
+      try:
+        async for event in self._aanswer_events(user_query, session):
+          yield event
+      finally:
+        session.retrieved_data = []
+        self.sessions.save(session)
+
+  async def _aanswer_events(self, user_query: str, session: Session) -> AsyncIterator[dict[str, Any]]:
+    session.retrieved_data = []
+    retrieved = ""
+    tool = ""
+    
+    if self.self_critic:
+      while session.retrieval_count == 0 or await self._aself_evaluate(user_query, retrieved, session):
+        print(session.retrieval_count)
+        decision = await self._adecide(user_query, session)
+        tool = decision.tool
+        yield {"type": "tool", "tool": tool, "parameters": decision.tool_parameters}
+        if tool == "cypher_search":
+          retrieved = await self.tools["cypher_search"].aexecute(user_query=user_query)
+        elif tool == "embedded_search":
+          retrieved = await self.tools["embed_search"].aexecute(user_query=user_query, k=decision.tool_parameters["k"])
+        elif tool == "pubmed_search":
+          try:
+            retrieved = await self.tools["pubmed_search"].aexecute(user_query=decision.tool_parameters["query"], number_to_retrieve=decision.tool_parameters["number"], type=decision.tool_parameters["type"])
+          except:
+            retrieved = ""
+            session.notes += "no pmcids were found for the pubmed ids, retry with different ones, maybe try abstract or higher k"
+        elif tool == "semmed_search":
+          retrieved = await self.tools["semmed_search"].aexecute(user_query=user_query, k=decision.tool_parameters["k"])
+        elif tool == "conversation":
+          final_answer = decision.tool_parameters["message"]
+          session.state.memory.add_turn(user_query, final_answer)
+          yield {"type": "token", "content": final_answer}
+          yield {"type": "done", "answer": final_answer}
+          return
+        else: 
+          raise ValueError(f"in answer, expected valid tool selection ['cypher_search', 'embed_search', 'pubmed_search', 'semmed_search'] but got {tool}")
+        session.retrieval_count += 1
+        yield {"type": "retrieval", "tool": tool, "round": session.retrieval_count, "found": bool(retrieved)}
+      session.tool_success = [] 
+      session.retrieval_count = 0
+    else:
+      decision = await self._adecide(user_query, session)
+      tool = decision.tool
+      yield {"type": "tool", "tool": tool, "parameters": decision.tool_parameters}
+      if tool == "cypher_search":
+        retrieved = await self.tools["cypher_search"].aexecute(user_query=user_query)
+      elif tool == "embedded_search":
+        retrieved = await self.tools["embed_search"].aexecute(user_query=user_query, k=decision.tool_parameters["k"])
+      elif tool == "pubmed_search":
+        try:
+          retrieved = await self.tools["pubmed_search"].aexecute(user_query=decision.tool_parameters["query"], number_to_retrieve=decision.tool_parameters["number"], type=decision.tool_parameters["type"])
+        except:
+          session.retrieval_count += 1
+      elif tool == "semmed_search":
+        retrieved = await self.tools["semmed_search"].aexecute(user_query=user_query, k=decision.tool_parameters["k"])
+      elif tool == "conversation":
+        final_answer = decision.tool_parameters["message"]
+        session.state.memory.add_turn(user_query, final_answer)
+        yield {"type": "token", "content": final_answer}
+        yield {"type": "done", "answer": final_answer}
+        return
+      session.retrieved_data.append(retrieved)
+      yield {"type": "retrieval", "tool": tool, "round": 1, "found": bool(retrieved)}
+    
+    chunks = []
+    async for chunk in self._afinal_answer_stream(user_query, session.retrieved_data, tool):
+      chunks.append(chunk)
+      yield {"type": "token", "content": chunk}
+    final_answer = "".join(chunks)
+    if self.debug:
+      print(final_answer)
     
-    state_update_str += f"Answer: {final_answer}\n"
-    self.state.past_messages += state_update_str
+    session.state.memory.add_turn(user_query, final_answer)
     
-    return final_answer
+    yield {"type": "done", "answer": final_answer}
 
-  def _decide(self, user_query: str) -> Decision: 
+  def _decide(self, user_query: str, session: Session) -> Decision: 
+    llm_chain = self._decide_chain(session)
+    return self._parse_decision(llm_chain.invoke({"user_query": user_query, "past_messages": session.state.past_messages}))
+  
+  async def _adecide(self, user_query: str, session: Session) -> Decision:
+    llm_chain = self._decide_chain(session)
+    return self._parse_decision(await llm_chain.ainvoke({"user_query": user_query, "past_messages": session.state.past_messages}))
+  
+  def _decide_chain(self, session: Session):
     system_prompt = """
       You are a professional decision maker that chooses the best tool for user queries in the biological domain. 
       You will be provided a user query and optionally the agent state. Each tool has parameters, only fill them if the tool
@@ -170,21 +309,22 @@ class Agent:
     """
         
     human_prompt = "The user query is: {user_query}"
-    #if self.state.past_messages:
-      #human_prompt += f"\n and the agent state is: {self.state.past_messages}"
-    if self.notes:
-      human_prompt += f"\n and the notes of previous runes is {self.notes}"
-    if self.tool_success:
-      human_prompt += f"\n and the success of previously used tools is: {self.tool_success}"
+    #passed as a variable, past answers can contain braces
+    if session.state.past_messages:
+      human_prompt += "\n and the agent state is: {past_messages}"
+    if session.notes:
+      human_prompt += f"\n and the notes of previous runes is {session.notes}"
+    if session.tool_success:
+      human_prompt += f"\n and the success of previously used tools is: {session.tool_success}"
     
     prompt = ChatPromptTemplate.from_messages([
       ("system", system_prompt),
       ("human", human_prompt)
     ])
     
-    llm_chain = prompt | self.answer_model
-    
-    decision = llm_chain.invoke({"user_query": user_query})
+    return prompt | self.answer_model
+  
+  def _parse_decision(self, decision) -> Decision:
     if self.debug:
       print(decision)
       
@@ -195,6 +335,29 @@ class Agent:
     return Decision(tool=tool_json["tool_to_use"], tool_parameters=tool_json["tool_parameters"])
 
   def _final_answer(self, user_query: str, retrieved_content: Any, tool_used: str) -> str:
+    final_response = "".join(self._final_answer_stream(user_query, retrieved_content, tool_used))
+    if self.debug:
+      print(final_response)
+    return final_response
+
+  def _final_answer_stream(self, user_query: str, retrieved_content: Any, tool_used: str) -> Iterator[str]:
+    """streams the final answer text chunk by chunk as the answer model generates it"""
+    llm_chain, inputs = self._final_answer_chain(user_query, retrieved_content, tool_used)
+    for chunk in llm_chain.stream(inputs):
+      content = chunk.content if isinstance(chunk.content, str) else str(chunk.content)
+      if content:
+        yield content
+  
+  async def _afinal_answer_stream(self, user_query: str, retrieved_content: Any, tool_used: str) -> AsyncIterator[str]:
+    #packing the context chunks, counts tokens and reranks, cpu bound so off the event loop
+    llm_chain, inputs = await asyncio.to_thread(self._final_answer_chain, user_query, retrieved_content, tool_used)
+    async for chunk in llm_chain.astream(inputs):
+      content = chunk.content if isinstance(chunk.content, str) else str(chunk.content)
+      if content:
+        yield content
+  
+  def _final_answer_chain(self, user_query: str, retrieved_content: Any, tool_used: str):
+    """final answer prompt chain and its inputs, the retrieved content packed into the context budget"""
     system_prompt = """
     You are a professional expert in the biology field. You are given a user query and retrieved information. Using this retrieved information, please 
     answer the question to the best of your ability. 
@@ -216,22 +379,50 @@ class Agent:
       ("system", system_prompt),
       ("human", human_prompt)
     ])
-    str_retrieve_content = str(retrieved_content)
-    llm_chain = prompt | self.answer_model
-    final_response = llm_chain.invoke({"user_query": user_query, "retrieved_content": str_retrieve_content}).content
+    retrieved_list = retrieved_content if isinstance(retrieved_content, list) else [retrieved_content]
+    str_retrieve_content, context_report = self.context_builder.build(user_query, retrieved_list)
     if self.debug:
-      print(final_response)
-      
-    if not isinstance(final_response, str):
-        final_response = str(final_response)
-    return final_response
+      print(f"in _final_answer, context {context_report}")
+    return prompt | self.answer_model, {"user_query": user_query, "retrieved_content": str_retrieve_content}
+  
+  def _summarize_turns(self, summary: str, turns: list[Turn]) -> str:
+    """folds turns that left the conversation window into the running summary"""
+    system_prompt = """You maintain a running summary of a conversation between a user and a biology assistant. 
+    Update the summary with the new turns, keep names of vaccines, pathogens, hosts and papers the user asked about, 
+    and keep it under 150 words. Your output should strictly be the updated summary."""
+    
+    human_prompt = "The current summary is: {summary}\n and the new turns are: {turns}"
+    
+    prompt = ChatPromptTemplate([
+      ("system", system_prompt),
+      ("human", human_prompt)
+    ])
+    
+    llm_chain = prompt | self.helper_model
+    turns_str = "\n".join(f"User query: {query}\nAnswer: {answer}" for query, answer in turns)
+    new_summary = llm_chain.invoke({"summary": summary or "(empty)", "turns": turns_str}).content
+    return new_summary if isinstance(new_summary, str) else str(new_summary)
   
-  def _self_evaluate(self, user_query: str, retrieved_data: str):
+  def _self_evaluate(self, user_query: str, retrieved_data: str, session: Session):
     """Evaluates and decides whether additional information is needed or the retrieval is good"""
-    if self.retrieval_count >= 3:
-      self.retrieved_data += "\n" + str(retrieved_data)
+    if session.retrieval_count >= 3:
+      session.retrieved_data.append(retrieved_data)
+      return False
+    
+    llm_chain = self._evaluate_chain(user_query, retrieved_data)
+    final_response = llm_chain.invoke({"user_query": user_query, "retrieved_data": retrieved_data}).content
+    return self._apply_evaluation(final_response, retrieved_data, session)
+  
+  async def _aself_evaluate(self, user_query: str, retrieved_data: str, session: Session):
+    if session.retrieval_count >= 3:
+      session.retrieved_data.append(retrieved_data)
       return False
     
+    llm_chain = self._evaluate_chain(user_query, retrieved_data)
+    final_response = (await llm_chain.ainvoke({"user_query": user_query, "retrieved_data": retrieved_data})).content
+    return self._apply_evaluation(final_response, retrieved_data, session)
+  
+  def _evaluate_chain(self, user_query: str, retrieved_data: str):
     system_prompt = """You are an evaluator of a retriever system, you will determine whether or not the information is relevant to the questions.
       correct - will give this information an agent that answers the query using this information.
       more_info will do re-retrieval but on a different resource.
@@ -245,22 +436,24 @@ class Agent:
       ("human", human_prompt)
     ])
     
-    llm_chain = prompt | self.answer_model
-    final_response = llm_chain.invoke({"user_query": user_query, "retrieved_data": retrieved_data}).content
+    return prompt | self.answer_model
+  
+  def _apply_evaluation(self, final_response, retrieved_data: str, session: Session) -> bool:
+    """records the evaluator's verdict, True when another retrieval round is needed"""
     if self.debug:
       print("=" * 30 + "\n", "kept content:")
       print(final_response)
       
     if final_response == "correct":
-      self.tool_success.append("success")
-      self.retrieved_data += "\n" + str(retrieved_data)
+      session.tool_success.append("success")
+      session.retrieved_data.append(retrieved_data)
       return False
     elif final_response == "more_info":
-      self.tool_success.append("partial_success")
-      self.retrieved_data += "\n" + str(retrieved_data)
+      session.tool_success.append("partial_success")
+      session.retrieved_data.append(retrieved_data)
       return True
     elif final_response == "incorrect":
-      self.tool_success.append("failure")
+      session.tool_success.append("failure")
       return True
     else:
       raise ValueError(f"in self_evaluate, expected a valid response ['correct', 'more_info', 'incorrect'] but got {final_response}")
\ No newline at end of file
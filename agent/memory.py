@@ -0,0 +1,131 @@
+from helpers.context import token_counter
+
+from concurrent.futures import Executor
+from typing import Callable, Optional
+import sys
+import threading
+
+Turn = tuple[str, str]
+
+
+class ConversationMemory:
+  """Conversation history under a token budget: a window of the most recent turns plus a running summary of older
+  ones. Turns that fall out of the window are summarized on executor, off the request path; until that finishes they
+  are still rendered if the budget allows"""
+
+  def __init__(self,
+               token_budget: int = 1500,
+               window_turns: int = 6,
+               summarize: Optional[Callable[[str, list[Turn]], str]] = None,
+               executor: Optional[Executor] = None,
+               count_tokens: Optional[Callable[[str], int]] = None) -> None:
+    self.token_budget: int = token_budget
+    self.window_turns: int = window_turns
+    self.summarize = summarize
+    self.executor = executor
+    self.count_tokens: Callable[[str], int] = count_tokens or token_counter()
+    self.summary: str = ""
+    self.window: list[Turn] = []
+    #turns out of the window, waiting to be folded into the summary
+    self.pending: list[Turn] = []
+    self.summarized_turns: int = 0
+    self._summarizing = False
+    self._lock = threading.Lock()
+
+  def add_turn(self, user_query: str, answer: str) -> None:
+    """records a turn, moving turns past the window (or past half the budget) to be summarized"""
+
+    with self._lock:
+      self.window.append((user_query, answer))
+      while len(self.window) > 1 and (len(self.window) > self.window_turns or
+                                      self._tokens(self.window) > self.token_budget // 2):
+        self.pending.append(self.window.pop(0))
+    self._schedule_summary()
+
+  def render(self) -> str:
+    """summary and the most recent turns that fit in token_budget, oldest first"""
+
+    with self._lock:
+      summary = self.summary
+      turns = self.pending + self.window
+    used = self.count_tokens(summary) if summary else 0
+    kept: list[str] = []
+    for user_query, answer in reversed(turns):
+      text = _format_turn(user_query, answer)
+      tokens = self.count_tokens(text)
+      if used + tokens > self.token_budget:
+        break
+      kept.append(text)
+      used += tokens
+    parts = [f"Summary of earlier conversation: {summary}"] if summary else []
+    return "\n".join(parts + kept[::-1])
+
+  def stats(self) -> dict[str, int]:
+    """memory held and tokens the rendered history adds to a prompt"""
+
+    with self._lock:
+      turns = len(self.window)
+      pending = len(self.pending)
+      summary_tokens = self.count_tokens(self.summary) if self.summary else 0
+    return {
+      "turns": turns,
+      "pending_turns": pending,
+      "summarized_turns": self.summarized_turns,
+      "summary_tokens": summary_tokens,
+      "prompt_tokens": self.count_tokens(self.render()),
+      "token_budget": self.token_budget,
+      "bytes": self.size_bytes(),
+    }
+
+  def size_bytes(self) -> int:
+    with self._lock:
+      turns = self.window + self.pending
+      return sys.getsizeof(self.summary) + sum(sys.getsizeof(query) + sys.getsizeof(answer) for query, answer in turns)
+
+  def _tokens(self, turns: list[Turn]) -> int:
+    return sum(self.count_tokens(_format_turn(query, answer)) for query, answer in turns)
+
+  def _schedule_summary(self) -> None:
+    with self._lock:
+      if self._summarizing or not self.pending:
+        return
+      self._summarizing = True
+    if self.executor is None:
+      self._summarize_pending()
+    else:
+      self.executor.submit(self._summarize_pending)
+
+  def _summarize_pending(self) -> None:
+    """folds the pending turns into the summary, repeating while new turns arrived meanwhile"""
+
+    while True:
+      with self._lock:
+        summary = self.summary
+        batch = list(self.pending)
+        if not batch:
+          self._summarizing = False
+          return
+      new_summary = None
+      if self.summarize is not None:
+        try:
+          new_summary = self.summarize(summary, batch)
+        except Exception as e:
+          print(f"in ConversationMemory, summarizing failed with {e}, keeping the latest turns verbatim")
+      if new_summary is None:
+        new_summary = " ".join([summary] + [_format_turn(query, answer) for query, answer in batch]).strip()
+      with self._lock:
+        self.summary = self._trim(new_summary)
+        del self.pending[:len(batch)]
+        self.summarized_turns += len(batch)
+
+  def _trim(self, summary: str) -> str:
+    """keeps the end of the summary within half the token budget"""
+
+    limit = self.token_budget // 2
+    while summary and self.count_tokens(summary) > limit:
+      summary = summary[len(summary) // 4:]
+    return summary
+
+
+def _format_turn(user_query: str, answer: str) -> str:
+  return f"User query: {user_query}\nAnswer: {answer}"
@@ -0,0 +1,91 @@
+from helpers.cache import LRUCache
+from agent.memory import ConversationMemory
+
+from typing import Any, Callable, Optional
+import asyncio
+import sys
+import threading
+import time
+
+
+class State:
+  def __init__(self, memory: Optional[ConversationMemory] = None):
+    self.memory: ConversationMemory = memory or ConversationMemory()
+    self.performance_history = []
+
+  @property
+  def past_messages(self) -> str:
+    """conversation history as it goes into a prompt"""
+    return self.memory.render()
+
+
+class Session:
+  """Per user conversation state, the Agent's models, drivers and indexes are shared between sessions"""
+
+  def __init__(self, session_id: str, memory: Optional[ConversationMemory] = None):
+    self.session_id = session_id
+    self.state = State(memory)
+    #raw results of every retrieval round, packed into the prompt by the agent's context_builder
+    self.retrieved_data: list[Any] = []
+    self.retrieval_count: int = 0
+    self.tool_success: list[str] = []
+    self.notes: str = ""
+    self.created: float = time.time()
+    #one answer at a time per session, lock for the threaded server and alock for the asyncio one
+    self.lock = threading.Lock()
+    self.alock = asyncio.Lock()
+
+  def size_bytes(self) -> int:
+    """approximate memory held by the session's conversation and retrieval state"""
+
+    size = self.state.memory.size_bytes() + sys.getsizeof(self.notes)
+    size += sum(sys.getsizeof(status) for status in self.tool_success)
+    size += sum(sys.getsizeof(str(result)) for result in self.retrieved_data)
+    return size
+
+  def stats(self) -> dict[str, Any]:
+    """memory held by the session and the conversation history's prompt footprint"""
+
+    return {"session_id": self.session_id, "bytes": self.size_bytes(), "memory": self.state.memory.stats()}
+
+
+class SessionStore:
+  """Sessions by id in an LRU with a time to live, capped by count and by approximate memory"""
+
+  def __init__(self, 
+               max_sessions: int = 1000, 
+               ttl: Optional[float] = 3600, 
+               max_bytes: int = 64 * 1024 * 1024,
+               memory_factory: Optional[Callable[[], ConversationMemory]] = None):
+    self.memory_factory = memory_factory or ConversationMemory
+    self._sessions = LRUCache(max_sessions, ttl, max_bytes, sizeof=lambda session: session.size_bytes())
+    self._lock = threading.Lock()
+
+  def get(self, session_id: str) -> Session:
+    """the session for session_id, a new one when it is unknown, expired or was evicted"""
+
+    with self._lock:
+      session = self._sessions.get(session_id)
+      if session is None:
+        session = Session(session_id, self.memory_factory())
+        self._sessions.put(session_id, session)
+      return session
+
+  def save(self, session: Session) -> None:
+    """re-accounts the session's size after an answer grew it, evicting other sessions past the memory cap"""
+
+    self._sessions.put(session.session_id, session)
+
+  def drop(self, session_id: str) -> bool:
+    return self._sessions.invalidate(lambda key: key == session_id) > 0
+
+  def session_stats(self, session_id: str) -> Optional[dict[str, Any]]:
+    """stats of one session, None when it is unknown"""
+
+    session = self._sessions.get(session_id)
+    return session.stats() if session is not None else None
+
+  def stats(self) -> dict[str, float]:
+    stats = self._sessions.stats()
+    stats["sessions"] = stats.pop("size")
+    return stats
@@ -1,8 +1,10 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 from dotenv import load_dotenv
+import json
 import os
 import sys
+import uuid
 sys.path.append("../")
 
 from agent.agent import Agent
@@ -24,11 +26,42 @@ CORS(app)
 def generateAnswer():
   data = request.get_json()
   if not data or 'input' not in data:
-    return jsonify({"error": "Invalid input"}, 400)
+    return jsonify({"error": "Invalid input"}), 400
   
   user_query = data['input']
-  answer = local_agent.answer(user_query)
-  return jsonify({"response": answer, "cypher": "null", "data": "null"})
+  #each browser sends its own session id, requests without one get a fresh session
+  session_id = data.get('session_id') or str(uuid.uuid4())
+  answer = local_agent.answer(user_query, session_id)
+  return jsonify({"response": answer, "cypher": "null", "data": "null", "session_id": session_id})
+
+@app.route("/api/chat/stream", methods=["POST"])
+def streamAnswer():
+  """server-sent events version of /api/chat, emits tool, retrieval and token events as they happen then done"""
+  data = request.get_json()
+  if not data or 'input' not in data:
+    return jsonify({"error": "Invalid input"}), 400
+  
+  user_query = data['input']
+  session_id = data.get('session_id') or str(uuid.uuid4())
+  
+  def events():
+    try:
+      for event in local_agent.answer_stream(user_query, session_id):
+        yield f"data: {json.dumps(event, default=str)}\n\n"
+    except Exception as e:
+      yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
+  
+  #no-cache and X-Accel-Buffering keep proxies from holding tokens back until the answer is complete
+  return Response(stream_with_context(events()), mimetype="text/event-stream",
+                  headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route("/api/session/<session_id>", methods=["GET"])
+def sessionStats(session_id):
+  """memory held by a session and the prompt tokens its conversation history adds"""
+  stats = local_agent.sessions.session_stats(session_id)
+  if stats is None:
+    return jsonify({"error": "Unknown session"}), 404
+  return jsonify(stats)
 
 if __name__ == "__main__":
   app.run(debug=True)
\ No newline at end of file
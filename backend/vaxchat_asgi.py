@@ -0,0 +1,98 @@
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+from dotenv import load_dotenv
+import json
+import os
+import sys
+import uuid
+sys.path.append("../")
+
+from agent.agent import Agent
+from drivers.neo4j_drive import aclose_all
+
+#asyncio serving path, same api as vaxchat.py but concurrent chats overlap their llm, neo4j and NCBI waits
+#run with: uvicorn vaxchat_asgi:app --port 5000
+
+load_dotenv("langchain.env")
+os.environ["LANGCHAIN_TRACING_V2"] = os.getenv("LANGCHAIN_TRACING", "")
+os.environ["LANGCHAIN_API_KEY"] = os.getenv("LANGCHAIN_API_KEY", "")
+os.environ["LANGCHAIN_ENDPOINT"] = os.getenv("LANGCHAIN_ENDPOINT", "")
+
+load_dotenv("email.env")
+email = os.getenv("EMAIL", "")
+
+#the async neo4j drivers are only built here, shutdown() closes them
+local_agent = Agent(email, debug=True, async_drivers=True)
+
+
+async def readInput(request: Request):
+  """the json body, None when it is empty or malformed so the routes answer 400 like the flask backend"""
+  try:
+    return await request.json()
+  except ValueError:
+    return None
+
+
+async def generateAnswer(request: Request):
+  data = await readInput(request)
+  if not isinstance(data, dict) or 'input' not in data:
+    return JSONResponse({"error": "Invalid input"}, status_code=400)
+
+  #each browser sends its own session id, requests without one get a fresh session
+  session_id = data.get('session_id') or str(uuid.uuid4())
+  answer = await local_agent.aanswer(data['input'], session_id)
+  return JSONResponse({"response": answer, "cypher": "null", "data": "null", "session_id": session_id})
+
+
+async def streamAnswer(request: Request):
+  """server-sent events version of /api/chat, emits tool, retrieval and token events as they happen then done"""
+  data = await readInput(request)
+  if not isinstance(data, dict) or 'input' not in data:
+    return JSONResponse({"error": "Invalid input"}, status_code=400)
+
+  user_query = data['input']
+  session_id = data.get('session_id') or str(uuid.uuid4())
+
+  async def events():
+    try:
+      async for event in local_agent.aanswer_stream(user_query, session_id):
+        yield f"data: {json.dumps(event, default=str)}\n\n"
+    except Exception as e:
+      yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
+
+  return StreamingResponse(events(), media_type="text/event-stream",
+                           headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+async def sessionStats(request: Request):
+  """memory held by a session and the prompt tokens its conversation history adds"""
+  stats = local_agent.sessions.session_stats(request.path_params["session_id"])
+  if stats is None:
+    return JSONResponse({"error": "Unknown session"}, status_code=404)
+  return JSONResponse(stats)
+
+
+async def shutdown():
+  await aclose_all()
+  pubmed_search = local_agent.tools.get("pubmed_search")
+  if pubmed_search is not None:
+    await pubmed_search.api_client.aclose() # type: ignore
+
+
+app = Starlette(
+  routes=[
+    Route("/api/chat", generateAnswer, methods=["POST"]),
+    Route("/api/chat/stream", streamAnswer, methods=["POST"]),
+    Route("/api/session/{session_id}", sessionStats, methods=["GET"]),
+  ],
+  middleware=[Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])],
+  on_shutdown=[shutdown],
+)
+
+if __name__ == "__main__":
+  import uvicorn
+  uvicorn.run(app, host="127.0.0.1", port=5000)
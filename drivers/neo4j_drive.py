@@ -1,15 +1,134 @@
-from neo4j import GraphDatabase, Driver
-from dotenv import load_dotenv
+from neo4j import AsyncDriver, AsyncGraphDatabase, GraphDatabase, Driver
+from dotenv import dotenv_values
+from typing import Any, Optional, Union
 import os
+import threading
 
-def connect_neo4j(dotenv_name: str = "../neo4j.env") -> Driver:
-  """Connects to Neo4j instance, requires login credentials in neo4j.env"""
-  
-  load_dotenv(dotenv_name)
-  uri = os.getenv("NEO4J_URI")
-  user = os.getenv("NEO4J_USER")
-  password = os.getenv("NEO4J_PASSWORD")
+#pool settings fall back to these env vars, then to the neo4j driver defaults
+POOL_SETTINGS = {
+  "max_connection_pool_size": ("NEO4J_MAX_POOL_SIZE", int),
+  "connection_acquisition_timeout": ("NEO4J_ACQUISITION_TIMEOUT", float),
+  "max_connection_lifetime": ("NEO4J_MAX_CONNECTION_LIFETIME", float),
+}
+
+_drivers: dict[tuple[str, str], Driver] = {}
+_async_drivers: dict[tuple[str, str], AsyncDriver] = {}
+_profiles: dict[tuple[str, str], dict[str, Any]] = {}
+_dotenv_profiles: dict[str, tuple[str, str]] = {}
+_lock = threading.Lock()
+
+
+def connect_neo4j(dotenv_name: str = "../neo4j.env", **pool_settings: Any) -> Driver:
+  """Connects to Neo4j instance, requires login credentials in neo4j.env. Each connection profile (uri, user)
+  gets one pooled driver per process that every caller shares"""
+
+  dotenv_path = os.path.abspath(dotenv_name)
+  profile = _dotenv_profiles.get(dotenv_path)
+  if profile is not None and profile in _drivers:
+    return _drivers[profile]
+
+  with _lock:
+    profile, password, settings = _resolve_profile(dotenv_path, pool_settings)
+    if profile not in _drivers:
+      _drivers[profile] = GraphDatabase.driver(profile[0], auth=(profile[1], password), **settings)
+    return _drivers[profile]
+
+
+def connect_neo4j_async(dotenv_name: str = "../neo4j.env", **pool_settings: Any) -> AsyncDriver:
+  """async counterpart of connect_neo4j for the asyncio serving path, one shared AsyncDriver per connection profile"""
+
+  dotenv_path = os.path.abspath(dotenv_name)
+  profile = _dotenv_profiles.get(dotenv_path)
+  if profile is not None and profile in _async_drivers:
+    return _async_drivers[profile]
+
+  with _lock:
+    profile, password, settings = _resolve_profile(dotenv_path, pool_settings)
+    if profile not in _async_drivers:
+      _async_drivers[profile] = AsyncGraphDatabase.driver(profile[0], auth=(profile[1], password), **settings)
+    return _async_drivers[profile]
+
+
+def _resolve_profile(dotenv_path: str, pool_settings: dict[str, Any]) -> tuple[tuple[str, str], str, dict[str, Any]]:
+  """(uri, user) profile, password and pool settings for a dotenv file, registering the profile on first use.
+  Caller holds _lock"""
+
+  #read the file directly, load_dotenv won't override NEO4J_URI once another profile set it
+  config = {key: os.getenv(key) for key in ("NEO4J_URI", "NEO4J_USER", "NEO4J_PASSWORD")}
+  config.update({key: value for key, value in dotenv_values(dotenv_path).items() if value})
+  uri = config.get("NEO4J_URI")
+  user = config.get("NEO4J_USER")
+  password = config.get("NEO4J_PASSWORD")
   if not uri or not user or not password:
     raise ValueError("in connect_neo4j, expected login credentials but got None")
-  driver = GraphDatabase.driver(uri, auth=(user, password))
-  return driver
\ No newline at end of file
+
+  profile = (uri, user)
+  if profile not in _profiles:
+    _profiles[profile] = {"uri": uri, "user": user, "settings": _pool_settings(config, pool_settings), "dotenv": []}
+  if dotenv_path not in _profiles[profile]["dotenv"]:
+    _profiles[profile]["dotenv"].append(dotenv_path)
+  _dotenv_profiles[dotenv_path] = profile
+  return profile, password, _profiles[profile]["settings"]
+
+
+def pool_metrics() -> list[dict[str, Any]]:
+  """pool settings and per server in use / idle connection counts for every shared driver"""
+
+  metrics = []
+  for profile, info in list(_profiles.items()):
+    info = dict(info)
+    if profile in _drivers:
+      info["connections"] = _pool_usage(_drivers[profile])
+    if profile in _async_drivers:
+      info["async_connections"] = _pool_usage(_async_drivers[profile])
+    metrics.append(info)
+  return metrics
+
+
+def close_all() -> None:
+  """closes every shared driver, the next connect_neo4j builds new ones"""
+
+  with _lock:
+    for driver in _drivers.values():
+      driver.close()
+    _drivers.clear()
+    if not _async_drivers:
+      _profiles.clear()
+      _dotenv_profiles.clear()
+
+
+async def aclose_all() -> None:
+  """closes every shared async driver, call it from the event loop that used them"""
+
+  with _lock:
+    drivers = list(_async_drivers.values())
+    _async_drivers.clear()
+  for driver in drivers:
+    await driver.close()
+
+
+def _pool_settings(config: dict[str, Optional[str]], overrides: dict[str, Any]) -> dict[str, Any]:
+  """pool size, acquisition timeout and connection lifetime from arguments, then the profile's env vars"""
+
+  settings = {}
+  for name, (env_name, cast) in POOL_SETTINGS.items():
+    if name in overrides:
+      settings[name] = overrides[name]
+    elif config.get(env_name) or os.getenv(env_name):
+      settings[name] = cast(config.get(env_name) or os.getenv(env_name))
+  return settings
+
+
+def _pool_usage(driver: Union[Driver, AsyncDriver]) -> dict[str, dict[str, int]]:
+  """reads connection counts from the driver's pool, the driver has no public api for this"""
+
+  try:
+    connections = dict(driver._pool.connections) # type: ignore
+  except AttributeError:
+    return {}
+  usage = {}
+  for address, pooled in connections.items():
+    pooled = list(pooled)
+    in_use = sum(1 for connection in pooled if getattr(connection, "in_use", False))
+    usage[str(address)] = {"in_use": in_use, "idle": len(pooled) - in_use}
+  return usage
@@ -0,0 +1,112 @@
+import argparse
+import os
+import random
+import resource
+import sys
+import time
+import faiss
+import numpy as np
+from typing import Sequence
+
+sys.path.append("../")
+
+from embed_create.vector_store import VectorStore, entity_id
+
+
+def recall_latency_report(store: VectorStore,
+                          entities: Sequence[str],
+                          queries: Sequence[str],
+                          k: int = 10,
+                          knob_values: Sequence[int] = (1, 4, 16, 64, 256)) -> list[dict]:
+  """Builds store.index_type over entities and measures recall@k and latency against an exact flat baseline"""
+
+  entities = list(dict.fromkeys(entities))
+  embeddings = store.encode(entities)
+  query_vecs = store.encode(queries)
+
+  #same ids as the store so the neighbor sets are comparable
+  baseline = faiss.IndexIDMap2(faiss.IndexFlatIP(embeddings.shape[1]))
+  baseline.add_with_ids(embeddings, np.array([entity_id(entity) for entity in entities], dtype="int64")) # type: ignore
+  start = time.perf_counter()
+  _, truth = baseline.search(query_vecs, k) # type: ignore
+  flat_ms = (time.perf_counter() - start) * 1000 / len(queries)
+  report = [{"index_type": "flat", "knob": None, "recall": 1.0, "ms_per_query": flat_ms}]
+
+  store.create_index(entities)
+  if store.index_type == "flat":
+    return report
+
+  for knob in knob_values:
+    store.set_search_params(nprobe=knob, ef_search=knob)
+    start = time.perf_counter()
+    _, found = store.index.search(query_vecs, k) # type: ignore
+    ms = (time.perf_counter() - start) * 1000 / len(queries)
+    hits = sum(len(set(row_found) & set(row_truth)) for row_found, row_truth in zip(found, truth))
+    report.append({"index_type": store.index_type, "knob": knob, "recall": hits / truth.size, "ms_per_query": ms})
+  return report
+
+
+def _rss_bytes() -> int:
+  """current resident set size, peak RSS where /proc isn't available"""
+
+  try:
+    with open("/proc/self/statm") as statm:
+      return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+  except OSError:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def mmap_rss_check(store_name: str, max_ratio: float = 0.5) -> dict:
+  """Loads a saved store memory mapped and checks the RSS the load adds stays well below the index file size"""
+
+  store = VectorStore(store_name)
+  index_path, _ = store.paths("", "")
+  index_bytes = os.path.getsize(index_path)
+  before = _rss_bytes()
+  if not store.load():
+    raise ValueError(f"in mmap_rss_check, expected a saved store named {store_name}")
+  added = _rss_bytes() - before
+  report = {"index_bytes": index_bytes, "rss_added": added, "ratio": added / index_bytes}
+  if report["ratio"] > max_ratio:
+    raise ValueError(f"in mmap_rss_check, expected loading to add at most {max_ratio:.0%} of the index size to RSS "
+                     f"but it added {added / 1e6:.1f} MB for a {index_bytes / 1e6:.1f} MB index")
+  return report
+
+
+def main():
+  parser = argparse.ArgumentParser(description="recall vs latency of an ANN VectorStore against the flat baseline")
+  parser.add_argument("--store", default="graph_embed", help="name of a saved VectorStore to sample entities from")
+  parser.add_argument("--index-type", default="ivf", choices=["flat", "ivf", "ivfpq", "hnsw"])
+  parser.add_argument("--sample", type=int, default=0, help="number of entities to index, 0 for all")
+  parser.add_argument("--queries", type=int, default=200)
+  parser.add_argument("--k", type=int, default=10)
+  parser.add_argument("--check-mmap", action="store_true",
+                      help="only check that loading --store memory mapped adds little RSS")
+  args = parser.parse_args()
+
+  if args.check_mmap:
+    report = mmap_rss_check(args.store)
+    print(f"index {report['index_bytes'] / 1e6:.1f} MB, load added {report['rss_added'] / 1e6:.1f} MB RSS "
+          f"({report['ratio']:.0%})")
+    return
+
+  source = VectorStore(args.store)
+  if not source.load():
+    raise ValueError(f"in ann_benchmark, expected a saved store named {args.store}")
+  entities = list(source.entities)
+  if args.sample:
+    entities = random.sample(entities, min(args.sample, len(entities)))
+  queries = random.sample(entities, min(args.queries, len(entities)))
+
+  store = VectorStore(f"{args.store}_benchmark", index_type=args.index_type)
+  report = recall_latency_report(store, entities, queries, args.k)
+
+  print(f"{len(entities)} entities, {len(queries)} queries, k={args.k}")
+  print(f"{'index':<8}{'knob':>8}{'recall':>10}{'ms/query':>12}")
+  for row in report:
+    knob = "-" if row["knob"] is None else row["knob"]
+    print(f"{row['index_type']:<8}{knob:>8}{row['recall']:>10.3f}{row['ms_per_query']:>12.3f}")
+
+
+if __name__ == "__main__":
+  main()
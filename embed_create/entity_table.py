@@ -0,0 +1,83 @@
+import mmap
+import os
+import shutil
+import struct
+import numpy as np
+from array import array
+from typing import Iterable, Iterator, Sequence, Tuple
+
+#on-disk layout: header | count little endian int64 ids | (count + 1) uint64 offsets | utf-8 blob
+MAGIC = b"VXENTS\x00\x00"
+FORMAT_VERSION = 2
+HEADER = struct.Struct("<8sIIQ")
+
+
+class EntityTable(Sequence[str]):
+  """Read-only, memory-mapped view of the (id, entity string) rows written by EntityTable.write"""
+
+  def __init__(self, path: str) -> None:
+    self.path = path
+    with open(path, "rb") as file:
+      self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, version, _, count = HEADER.unpack_from(self._mmap, 0)
+    if magic != MAGIC:
+      self.close()
+      raise ValueError(f"in EntityTable, expected an entity table but got {path}")
+    if version != FORMAT_VERSION:
+      self.close()
+      raise ValueError(f"in EntityTable, expected format version {FORMAT_VERSION} but got {version}")
+
+    self.version: int = version
+    self._count: int = count
+    self.ids = np.frombuffer(self._mmap, dtype="<i8", count=count, offset=HEADER.size)
+    self._offsets = np.frombuffer(self._mmap, dtype="<u8", count=count + 1, offset=HEADER.size + 8 * count)
+    self._blob_start: int = HEADER.size + 8 * (2 * count + 1)
+
+  @staticmethod
+  def write(path: str, rows: Iterable[Tuple[int, str]]) -> None:
+    """Writes (id, entity) rows to path atomically, streaming the blob so only ids and offsets are held in memory"""
+
+    ids = array("q")
+    offsets = array("Q", [0])
+    blob_path = f"{path}.blob.tmp"
+    with open(blob_path, "wb") as blob:
+      for entity_id, entity in rows:
+        ids.append(entity_id)
+        offsets.append(offsets[-1] + blob.write(entity.encode("utf-8")))
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as file, open(blob_path, "rb") as blob:
+      file.write(HEADER.pack(MAGIC, FORMAT_VERSION, 0, len(ids)))
+      file.write(np.asarray(ids, dtype="<i8").tobytes())
+      file.write(np.asarray(offsets, dtype="<u8").tobytes())
+      shutil.copyfileobj(blob, file)
+    os.remove(blob_path)
+    #readers of the old file keep their mapping until they reload
+    os.replace(tmp_path, path)
+
+  def __len__(self) -> int:
+    return self._count
+
+  def __getitem__(self, idx):  # type: ignore[override]
+    if isinstance(idx, slice):
+      return [self[i] for i in range(*idx.indices(self._count))]
+    idx = int(idx)
+    if idx < 0:
+      idx += self._count
+    if idx < 0 or idx >= self._count:
+      raise IndexError(f"in EntityTable, index {idx} out of range for {self._count} entities")
+    start = self._blob_start + int(self._offsets[idx])
+    end = self._blob_start + int(self._offsets[idx + 1])
+    return self._mmap[start:end].decode("utf-8")
+
+  def __iter__(self) -> Iterator[str]:
+    for idx in range(self._count):
+      yield self[idx]
+
+  def close(self) -> None:
+    """Releases the mapping, the table can not be read afterwards"""
+
+    self.ids = None
+    self._offsets = None
+    self._mmap.close()
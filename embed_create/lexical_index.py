@@ -0,0 +1,102 @@
+import re
+import threading
+from typing import Any, Iterable, Optional, Tuple
+
+_NON_WORD = re.compile(r"[^\w\s]")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+  """casefolds, drops punctuation and collapses whitespace so trivially different spellings compare equal"""
+
+  return _SPACES.sub(" ", _NON_WORD.sub(" ", text.casefold())).strip()
+
+
+class LexicalIndex:
+  """Exact and character trigram lookup over the names of a VectorStore, used before falling back to embeddings.
+  A fuzzy match must also beat the next best name by fuzzy_margin, a short text close to several names ("brucella"
+  vs "Brucella suis" and "Brucella abortus") is left to the embeddings"""
+
+  def __init__(self, 
+               names: Iterable[str], 
+               fuzzy_threshold: float = 0.7, 
+               fuzzy_margin: float = 0.1,
+               ngram: int = 3, 
+               max_postings: int = 5000,
+               source_version: Any = None) -> None:
+    #version of the store the names came from, so callers know when to rebuild
+    self.source_version: Any = source_version
+    self.fuzzy_threshold: float = fuzzy_threshold
+    self.fuzzy_margin: float = fuzzy_margin
+    self.ngram: int = ngram
+    self.names: list[str] = []
+    self.exact: dict[str, str] = {}
+    self.gram_counts: list[int] = []
+    self.postings: dict[str, list[int]] = {}
+    self.counts = {"exact": 0, "fuzzy": 0, "ambiguous": 0, "miss": 0}
+    self._lock = threading.Lock()
+
+    for name in names:
+      key = normalize_text(name)
+      if not key or key in self.exact:
+        continue
+      self.exact[key] = name
+      grams = self._grams(key)
+      for gram in grams:
+        self.postings.setdefault(gram, []).append(len(self.names))
+      self.names.append(name)
+      self.gram_counts.append(len(grams))
+
+    #grams shared by most names don't discriminate and make lookups slow
+    self.postings = {gram: ids for gram, ids in self.postings.items() if len(ids) <= max_postings}
+
+  def lookup(self, text: str) -> Optional[Tuple[str, float, str]]:
+    """returns (name, score, "exact" | "fuzzy") or None when the text needs an embedding lookup"""
+
+    key = normalize_text(text)
+    if key in self.exact:
+      self._count("exact")
+      return self.exact[key], 1.0, "exact"
+
+    grams = self._grams(key)
+    overlaps: dict[int, int] = {}
+    for gram in grams:
+      for name_id in self.postings.get(gram, []):
+        overlaps[name_id] = overlaps.get(name_id, 0) + 1
+
+    best_id, best_score, runner_up = -1, 0.0, 0.0
+    for name_id, overlap in overlaps.items():
+      #dice coefficient over the trigram sets
+      score = 2 * overlap / (len(grams) + self.gram_counts[name_id])
+      if score > best_score:
+        best_id, best_score, runner_up = name_id, score, best_score
+      elif score > runner_up:
+        runner_up = score
+    if best_id >= 0 and best_score >= self.fuzzy_threshold:
+      if best_score - runner_up >= self.fuzzy_margin:
+        self._count("fuzzy")
+        return self.names[best_id], best_score, "fuzzy"
+      self._count("ambiguous")
+      return None
+
+    self._count("miss")
+    return None
+
+  def stats(self) -> dict[str, float]:
+    """lookup counters and the share of lookups that skipped the encoder"""
+
+    total = sum(self.counts.values())
+    hits = self.counts["exact"] + self.counts["fuzzy"]
+    return {**self.counts, "hit_rate": hits / total if total else 0.0}
+
+  def _grams(self, key: str) -> set[str]:
+    """padded character n-grams of a normalized string"""
+
+    padded = f" {key} "
+    if len(padded) <= self.ngram:
+      return {padded}
+    return {padded[i:i + self.ngram] for i in range(len(padded) - self.ngram + 1)}
+
+  def _count(self, kind: str) -> None:
+    with self._lock:
+      self.counts[kind] += 1
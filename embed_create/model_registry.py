@@ -0,0 +1,67 @@
+from sentence_transformers import SentenceTransformer
+from typing import Any
+import threading
+import time
+
+
+class ModelRegistry:
+  """Process-wide registry that loads each SentenceTransformer once and shares it between VectorStores"""
+
+  def __init__(self) -> None:
+    self._models: dict[str, SentenceTransformer] = {}
+    self._stats: dict[str, dict[str, Any]] = {}
+    self._lock = threading.Lock()
+
+  def get(self, model_name: str = "all-MiniLM-L6-v2") -> SentenceTransformer:
+    """returns the shared encoder for model_name, loading it on first use"""
+
+    model = self._models.get(model_name)
+    if model is not None:
+      self._stats[model_name]["requests"] += 1
+      return model
+
+    with self._lock:
+      #another thread may have finished loading while we waited
+      if model_name in self._models:
+        self._stats[model_name]["requests"] += 1
+        return self._models[model_name]
+
+      start = time.perf_counter()
+      model = SentenceTransformer(model_name)
+      load_seconds = time.perf_counter() - start
+
+      self._models[model_name] = model
+      self._stats[model_name] = {
+        "load_seconds": load_seconds,
+        "parameter_bytes": self._model_bytes(model),
+        "requests": 1,
+      }
+      return model
+
+  def stats(self) -> dict[str, dict[str, Any]]:
+    """returns load time, memory footprint and request count for every loaded model"""
+
+    return {name: dict(stat) for name, stat in self._stats.items()}
+
+  def clear(self) -> None:
+    """drops all loaded models, the next get() reloads them"""
+
+    with self._lock:
+      self._models.clear()
+      self._stats.clear()
+
+  def _model_bytes(self, model: SentenceTransformer) -> int:
+    """bytes held by the model parameters and buffers"""
+
+    total = 0
+    for tensor in list(model.parameters()) + list(model.buffers()):
+      total += tensor.numel() * tensor.element_size()
+    return total
+
+
+model_registry = ModelRegistry()
+
+
+def get_model(model_name: str = "all-MiniLM-L6-v2") -> SentenceTransformer:
+  """returns the process-wide shared SentenceTransformer for model_name"""
+  return model_registry.get(model_name)
@@ -0,0 +1,39 @@
+import argparse
+import sys
+
+sys.path.append("../")
+
+from drivers.neo4j_drive import close_all, connect_neo4j
+from embed_create.vector_store import VectorStore, entity_id
+from helpers.cypher import NAME_STORE_QUERIES, fetch_names
+from helpers.embed import EmbedAPI
+
+
+def main():
+  parser = argparse.ArgumentParser(description="incrementally update the VaxKG vector stores from neo4j")
+  parser.add_argument("--stores", nargs="*", default=list(NAME_STORE_QUERIES) + ["graph_embed"])
+  parser.add_argument("--debug", action="store_true")
+  args = parser.parse_args()
+
+  driver = connect_neo4j()
+  for name in args.stores:
+    if name == "graph_embed":
+      stats = EmbedAPI(driver, args.debug).update_vectorstore()
+    elif name in NAME_STORE_QUERIES:
+      store = VectorStore(name)
+      entities = fetch_names(driver, NAME_STORE_QUERIES[name])
+      if store.load():
+        stats = store.sync((entity_id(entity), entity) for entity in entities)
+      else:
+        store.create_index(entities)
+        store.save()
+        stats = {"added": len(store.entities), "changed": 0, "removed": 0, "unchanged": 0}
+    else:
+      raise ValueError(f"in refresh_stores, expected a store in {list(NAME_STORE_QUERIES) + ['graph_embed']} but got {name}")
+    print(f"{name}: {stats}")
+  #the driver is the registry's shared one, closing it directly would leave a closed driver to hand out
+  close_all()
+
+
+if __name__ == "__main__":
+  main()
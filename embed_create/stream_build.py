@@ -0,0 +1,151 @@
+import faiss
+import json
+import os
+import numpy as np
+from typing import Iterator, Optional, Tuple
+
+from embed_create.vector_store import VectorStore, entity_id
+from embed_create.entity_table import EntityTable
+
+
+class StreamingBuilder:
+  """Builds a VectorStore batch by batch with periodic checkpoints so an interrupted build can resume. Index types that
+  need training (IVF, IVF-PQ) buffer train_size rows first"""
+
+  def __init__(self, store: VectorStore, train_size: int = 20000, checkpoint_every: int = 10, debug: bool = False) -> None:
+    self.store = store
+    self.train_size: int = train_size
+    self.checkpoint_every: int = checkpoint_every
+    self.debug: bool = debug
+
+    self.index_path, self.entities_path = store.paths("", "")
+    self.checkpoint_path: str = str(store.folder_path / f"{store.name}.build.json")
+    self.partial_index_path: str = f"{self.index_path}.partial"
+    self.checkpoint_seq: int = 0
+    self.partial_entities_path: str = f"{self.entities_path}.partial"
+
+    self.index: Optional[faiss.Index] = None
+    self.count: int = 0
+    self.batches_since_checkpoint: int = 0
+    self.cursor: int = 0
+    self._pending: list[Tuple[np.ndarray, np.ndarray]] = []
+    self._pending_count: int = 0
+
+  def resume(self) -> int:
+    """Restores the last checkpoint if there is one and returns the cursor to continue fetching from"""
+
+    if not os.path.exists(self.checkpoint_path):
+      self._reset_partial()
+      return 0
+
+    with open(self.checkpoint_path) as file:
+      checkpoint = json.load(file)
+    self.checkpoint_seq = checkpoint["seq"]
+    self.index = faiss.read_index(f"{self.partial_index_path}.{self.checkpoint_seq}")
+    self.count = checkpoint["count"]
+    self.cursor = checkpoint["cursor"]
+    #drop entity lines written after the checkpoint, the index doesn't contain them
+    with open(self.partial_entities_path, "r+b") as file:
+      file.truncate(checkpoint["entities_bytes"])
+    if self.debug:
+      print(f"in resume, {self.store.name} resuming at cursor {self.cursor} with {self.count} entities")
+    return self.cursor
+
+  def add_batch(self, entities: list[str], cursor: int, ids: Optional[list[int]] = None) -> None:
+    """Encodes one batch, adds it to the index under ids and checkpoints every checkpoint_every batches"""
+
+    if entities:
+      if ids is None:
+        ids = [entity_id(entity) for entity in entities]
+      embeddings = self.store.encode(entities)
+      id_array = np.array(ids, dtype="int64")
+      with open(self.partial_entities_path, "a", encoding="utf-8") as file:
+        for row_id, entity in zip(ids, entities):
+          file.write(json.dumps([row_id, entity]) + "\n")
+      if self.index is None and not self._pending:
+        index = self.store.build_index(embeddings.shape[1], self.train_size)
+        #flat and HNSW need no training, they take rows (and checkpoint) from the first batch
+        if index.is_trained:
+          self.index = index
+      if self.index is None:
+        #buffer a bounded training sample before the index type can be built and trained
+        self._pending.append((embeddings, id_array))
+        self._pending_count += len(embeddings)
+        if self._pending_count >= self.train_size:
+          self._flush_pending()
+      else:
+        self.index.add_with_ids(embeddings, id_array) # type: ignore
+      self.count += len(entities)
+
+    self.cursor = cursor
+    self.batches_since_checkpoint += 1
+    if self.index is not None and self.batches_since_checkpoint >= self.checkpoint_every:
+      self._checkpoint()
+
+  def finish(self) -> None:
+    """Writes the final index and entity table and removes the checkpoint files"""
+
+    self._flush_pending()
+    if self.index is None:
+      raise ValueError(f"in finish, expected entities for {self.store.name} but got none")
+
+    faiss.write_index(self.index, f"{self.index_path}.tmp")
+    os.replace(f"{self.index_path}.tmp", self.index_path)
+    EntityTable.write(self.entities_path, self._read_partial_entities())
+
+    self._reset_partial()
+    if not self.store.load():
+      raise ValueError(f"in finish, expected to load the built store {self.store.name}")
+
+  def _flush_pending(self) -> None:
+    """builds and trains the index on the buffered sample, then adds it"""
+
+    if not self._pending:
+      return
+    sample = np.concatenate([embeddings for embeddings, _ in self._pending])
+    sample_ids = np.concatenate([ids for _, ids in self._pending])
+    self._pending = []
+    self._pending_count = 0
+    if self.index is None:
+      self.index = self.store.build_index(sample.shape[1], len(sample))
+      if not self.index.is_trained:
+        self.index.train(sample) # type: ignore
+    self.index.add_with_ids(sample, sample_ids) # type: ignore
+
+  def _checkpoint(self) -> None:
+    """persists the partial index under a new sequence number, then switches the checkpoint to it atomically"""
+
+    previous_path = f"{self.partial_index_path}.{self.checkpoint_seq}"
+    self.checkpoint_seq += 1
+    faiss.write_index(self.index, f"{self.partial_index_path}.{self.checkpoint_seq}")
+    checkpoint = {
+      "seq": self.checkpoint_seq,
+      "cursor": self.cursor,
+      "count": self.count,
+      "entities_bytes": os.path.getsize(self.partial_entities_path),
+    }
+    with open(f"{self.checkpoint_path}.tmp", "w") as file:
+      json.dump(checkpoint, file)
+    os.replace(f"{self.checkpoint_path}.tmp", self.checkpoint_path)
+    if os.path.exists(previous_path):
+      os.remove(previous_path)
+    self.batches_since_checkpoint = 0
+    if self.debug:
+      print(f"in _checkpoint, {self.store.name} at cursor {self.cursor} with {self.count} entities")
+
+  def _read_partial_entities(self) -> Iterator[Tuple[int, str]]:
+    """streams the (id, entity) lines back in insertion order"""
+
+    with open(self.partial_entities_path, encoding="utf-8") as file:
+      for line in file:
+        row_id, entity = json.loads(line)
+        yield row_id, entity
+
+  def _reset_partial(self) -> None:
+    """removes checkpoint state from a previous build"""
+
+    folder = self.store.folder_path
+    partial_indexes = [str(path) for path in folder.glob(f"{os.path.basename(self.partial_index_path)}.*")]
+    for path in [self.checkpoint_path, self.partial_entities_path] + partial_indexes:
+      if os.path.exists(path):
+        os.remove(path)
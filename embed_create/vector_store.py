@@ -1,63 +1,322 @@
 import faiss
+import hashlib
 import numpy as np
-import pickle
+import os
 from sentence_transformers import SentenceTransformer
-from typing import Optional, Tuple
+from embed_create.model_registry import get_model
+from embed_create.entity_table import EntityTable
+from helpers.cache import LRUCache
+from typing import Callable, Iterable, Optional, Sequence, Tuple
 from pathlib import Path
+from itertools import chain, islice
+
+INDEX_TYPES = ["flat", "ivf", "ivfpq", "hnsw"]
+
+def entity_id(entity: str) -> int:
+  """stable 63 bit id for entities that have no node id, such as the NAME stores"""
+  
+  digest = hashlib.blake2b(entity.encode("utf-8"), digest_size=8).digest()
+  return int.from_bytes(digest, "little") & 0x7FFFFFFFFFFFFFFF
 
 class VectorStore:
-  def __init__(self, name: str, model_name: str = "all-MiniLM-L6-v2") -> None:
+  def __init__(self, 
+               name: str, 
+               model_name: str = "all-MiniLM-L6-v2",
+               index_type: str = "flat",
+               nlist: int = 0,
+               pq_m: int = 16,
+               hnsw_m: int = 32,
+               nprobe: int = 8,
+               ef_search: int = 64,
+               embedding_cache_size: int = 4096,
+               cache_ttl: Optional[float] = None) -> None:
+    if index_type not in INDEX_TYPES:
+      raise ValueError(f"in VectorStore, expected index_type in {INDEX_TYPES} but got {index_type}")
     self.name: str = name
-    self.model: SentenceTransformer = SentenceTransformer(model_name)
+    self.index_type: str = index_type
+    self.nlist: int = nlist
+    self.pq_m: int = pq_m
+    self.hnsw_m: int = hnsw_m
+    self.nprobe: int = nprobe
+    self.ef_search: int = ef_search
+    self.model_name: str = model_name
+    self.model: SentenceTransformer = get_model(model_name)
     self.index: Optional[faiss.Index] = None
-    self.entities: list[str] = []
+    self.entities: Sequence[str] = []
+    self.ids: np.ndarray = np.zeros(0, dtype="int64")
+    self._id_order: Optional[np.ndarray] = None
+    self._sorted_ids: Optional[np.ndarray] = None
     self.folder_path = Path("../embed_create/data")
     self.folder_path.mkdir(parents=True, exist_ok=True)
+    self.loaded_version: Optional[Tuple[int, ...]] = None
+    self.embedding_cache = LRUCache(embedding_cache_size, cache_ttl)
+    #called whenever the contents change, so caches built on top of the store can drop stale entries
+    self.listeners: list[Callable[[], None]] = []
     
-  def create_index(self, entities : list[str]) -> None:
-    """Create FAISS index from a list of entities as strings"""
+  def create_index(self, entities : list[str], ids: Optional[list[int]] = None) -> None:
+    """Create FAISS index from a list of entities as strings, keyed by ids (node ids) or a hash of the entity"""
     
-    self.entities = entities
-    embeddings = self.model.encode(entities, normalize_embeddings=True)
-    embeddings = np.array(embeddings, dtype="float32")
-    dim = embeddings.shape[1]
-    self.index = faiss.IndexFlatIP(dim)
-    self.index.add(embeddings) # type: ignore
+    if ids is None:
+      ids = [entity_id(entity) for entity in entities]
+    #duplicate names collapse onto one id, keep the first
+    rows: dict[int, str] = {}
+    for row_id, entity in zip(ids, entities):
+      rows.setdefault(row_id, entity)
+    self.entities = list(rows.values())
+    self._set_ids(np.array(list(rows.keys()), dtype="int64"))
+    
+    embeddings = self.encode(self.entities)
+    self.index = self.build_index(embeddings.shape[1], len(self.entities))
+    if not self.index.is_trained:
+      self.index.train(embeddings) # type: ignore
+    self.index.add_with_ids(embeddings, self.ids) # type: ignore
+    self.set_search_params()
+    self._changed()
+  
+  def sync(self, items: Iterable[Tuple[int, str]], batch_size: int = 2048) -> dict[str, int]:
+    """Brings the saved store in line with the (id, entity) items, only embedding added or changed entities 
+    and removing deleted ones"""
+    
+    if not self.load(mmap=False):
+      raise ValueError(f"in sync, expected a saved store named {self.name}, create it first")
+    
+    stats = {"added": 0, "changed": 0, "removed": 0, "unchanged": 0}
+    seen = np.zeros(len(self.ids), dtype=bool)
+    stale = np.zeros(len(self.ids), dtype=bool)
+    new_rows: dict[int, str] = {}
+    items = iter(items)
+    while batch := list(islice(items, batch_size)):
+      rows = self._rows_for(np.array([item_id for item_id, _ in batch], dtype="int64"))
+      for (item_id, entity), row in zip(batch, rows):
+        if item_id in new_rows:
+          continue
+        if row >= 0:
+          seen[row] = True
+          if self.entities[row] == entity:
+            stats["unchanged"] += 1
+            continue
+          stale[row] = True
+          stats["changed"] += 1
+        else:
+          stats["added"] += 1
+        new_rows[item_id] = entity
+    stats["removed"] = int((~seen).sum())
+    
+    keep = seen & ~stale
+    kept_rows = ((int(self.ids[row]), self.entities[row]) for row in np.flatnonzero(keep))
+    try:
+      if not keep.all():
+        self.index.remove_ids(self.ids[~keep].copy()) # type: ignore
+    except RuntimeError:
+      #hnsw can't remove vectors, rebuild from the surviving rows plus the new ones
+      rows = list(chain(kept_rows, new_rows.items()))
+      self.create_index([entity for _, entity in rows], [row_id for row_id, _ in rows])
+      self.save()
+      return stats
+    
+    new_items = list(new_rows.items())
+    for start in range(0, len(new_items), batch_size):
+      chunk = new_items[start:start + batch_size]
+      embeddings = self.encode([entity for _, entity in chunk])
+      self.index.add_with_ids(embeddings, np.array([row_id for row_id, _ in chunk], dtype="int64")) # type: ignore
+    
+    self._write(chain(kept_rows, new_items))
+    self.load()
+    return stats
+  
+  def encode(self, texts: Sequence[str]) -> np.ndarray:
+    """Encode texts into normalized float32 embeddings"""
+    
+    embeddings = self.model.encode(list(texts), normalize_embeddings=True)
+    return np.array(embeddings, dtype="float32")
+  
+  def encode_queries(self, texts: Sequence[str]) -> np.ndarray:
+    """Encode query texts, reusing cached embeddings and encoding only the uncached texts in one batch"""
+    
+    if not texts:
+      return np.zeros((0, 0), dtype="float32")
+    cached = [self.embedding_cache.get(text) for text in texts]
+    missing = list(dict.fromkeys(text for text, vector in zip(texts, cached) if vector is None))
+    if missing:
+      encoded = dict(zip(missing, self.encode(missing)))
+      for text, vector in encoded.items():
+        self.embedding_cache.put(text, vector)
+      cached = [encoded[text] if vector is None else vector for text, vector in zip(texts, cached)]
+    return np.array(cached, dtype="float32").reshape(len(texts), -1)
+  
+  def set_search_params(self, nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> None:
+    """Sets the search time recall/latency knob, nprobe for ivf indexes and efSearch for hnsw"""
+    
+    if nprobe is not None:
+      self.nprobe = nprobe
+    if ef_search is not None:
+      self.ef_search = ef_search
+    if self.index is None:
+      return
+    
+    ivf = faiss.try_extract_index_ivf(self.index)
+    if ivf is not None:
+      ivf.nprobe = self.nprobe
+      return
+    index = faiss.downcast_index(self.index)
+    if isinstance(index, faiss.IndexIDMap):
+      index = faiss.downcast_index(index.index)
+    if isinstance(index, faiss.IndexHNSW):
+      index.hnsw.efSearch = self.ef_search
+  
+  def build_index(self, dim: int, count: int) -> faiss.Index:
+    """builds an empty id mapped index of self.index_type, falls back to flat when there are too few entities to train"""
+    
+    return faiss.IndexIDMap2(self._build_base_index(dim, count))
+  
+  def _build_base_index(self, dim: int, count: int) -> faiss.Index:
+    """index of self.index_type that build_index wraps with node ids"""
+    
+    if self.index_type == "hnsw":
+      return faiss.IndexHNSWFlat(dim, self.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+    if self.index_type in ("ivf", "ivfpq"):
+      #faiss wants ~39 training points per list and 256 per pq codebook
+      nlist = self.nlist or int(4 * np.sqrt(count))
+      nlist = min(nlist, count // 39)
+      if nlist >= 1 and (self.index_type == "ivf" or count >= 256):
+        if self.index_type == "ivf":
+          description = f"IVF{nlist},Flat"
+        else:
+          description = f"IVF{nlist},PQ{self.pq_m}"
+        return faiss.index_factory(dim, description, faiss.METRIC_INNER_PRODUCT)
+      print(f"in build_index, {count} entities is too few to train {self.index_type} for {self.name}, using flat")
+    return faiss.IndexFlatIP(dim)
   
   def save(self, index_path: str = "", entities_path: str = "") -> None:
     """Save FAISS index and entities"""
   
-    if not index_path:
-      index_path = str(self.folder_path / f"{self.name}.index")
-    if not entities_path:
-      entities_path = str(self.folder_path / f"{self.name}.pkl")
-    with open(entities_path, "wb") as file:
-      pickle.dump(self.entities, file)
-    faiss.write_index(self.index, index_path)
+    self._write(zip(self.ids.tolist(), self.entities), index_path, entities_path)
+  
+  def _write(self, rows: Iterable[Tuple[int, str]], index_path: str = "", entities_path: str = "") -> None:
+    """writes the entity rows and the current index"""
+    
+    index_path, entities_path = self.paths(index_path, entities_path)
+    EntityTable.write(entities_path, rows)
+    #write then rename so workers with the old files mapped keep a consistent view
+    faiss.write_index(self.index, f"{index_path}.tmp")
+    os.replace(f"{index_path}.tmp", index_path)
+    self.loaded_version = self._file_version(index_path, entities_path)
       
-  def load(self, index_path: str = "", entities_path: str = "") -> bool:
-    """Load FAISS index and entites"""
+  def load(self, index_path: str = "", entities_path: str = "", mmap: bool = True) -> bool:
+    """Load FAISS index and entites, memory mapped so worker processes share pages through the page cache"""
     
-    if not index_path:
-      index_path =  str(self.folder_path / f"{self.name}.index")
-    if not entities_path:
-      entities_path = str(self.folder_path / f"{self.name}.pkl")
+    index_path, entities_path = self.paths(index_path, entities_path)
     
     try:
-      with open(entities_path, "rb") as file:
-        self.entities = pickle.load(file)
-        self.index = faiss.read_index(index_path)
-        return True
-    except:
+      version = self._file_version(index_path, entities_path)
+      entities = EntityTable(entities_path)
+      index = self._read_index(index_path, mmap)
+    except (OSError, ValueError, RuntimeError):
       return False
+    
+    self.entities = entities
+    self._set_ids(entities.ids)
+    self.index = index
+    self.loaded_version = version
+    self.set_search_params()
+    self._changed()
+    return True
+  
+  def refresh(self, index_path: str = "", entities_path: str = "") -> bool:
+    """Keeps the loaded index resident, only reloading when the files on disk changed"""
+    
+    index_path, entities_path = self.paths(index_path, entities_path)
+    
+    try:
+      version = self._file_version(index_path, entities_path)
+    except OSError:
+      #files are gone, keep serving whatever is resident
+      return self.index is not None
+    
+    if self.index is not None and version == self.loaded_version:
+      return True
+    return self.load(index_path, entities_path)
+  
+  def paths(self, index_path: str, entities_path: str) -> Tuple[str, str]:
+    """default file locations for the index and the entity table"""
+    
+    if not index_path:
+      index_path = str(self.folder_path / f"{self.name}.index")
+    if not entities_path:
+      entities_path = str(self.folder_path / f"{self.name}.entities")
+    return index_path, entities_path
+  
+  def _read_index(self, index_path: str, mmap: bool) -> faiss.Index:
+    """reads the FAISS index memory mapped, IO_FLAG_MMAP_IFC where the installed faiss has it since IO_FLAG_MMAP
+    only maps inverted lists and still copies flat and HNSW codes, then IO_FLAG_MMAP, then a full read"""
+    
+    if mmap:
+      flags = [getattr(faiss, "IO_FLAG_MMAP_IFC", None), faiss.IO_FLAG_MMAP]
+      for flag in flags:
+        if flag is None:
+          continue
+        try:
+          return faiss.read_index(index_path, flag | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError:
+          pass
+    return faiss.read_index(index_path)
+  
+  def _changed(self) -> None:
+    """drops cached embeddings and notifies listeners after a rebuild or reload"""
+    
+    self.embedding_cache.invalidate()
+    for listener in self.listeners:
+      listener()
+  
+  def _set_ids(self, ids: np.ndarray) -> None:
+    """replaces the row ids and drops the id lookup built for the previous ones"""
+    
+    self.ids = ids
+    self._id_order = None
+    self._sorted_ids = None
+  
+  def _rows_for(self, ids: np.ndarray) -> np.ndarray:
+    """maps entity ids to rows of self.entities, -1 for ids that aren't stored"""
+    
+    if self._id_order is None or self._sorted_ids is None:
+      self._id_order = np.argsort(self.ids, kind="stable")
+      self._sorted_ids = self.ids[self._id_order]
+    if len(self._sorted_ids) == 0:
+      return np.full(len(ids), -1, dtype="int64")
+    positions = np.clip(np.searchsorted(self._sorted_ids, ids), 0, len(self._sorted_ids) - 1)
+    rows = self._id_order[positions].astype("int64")
+    rows[self._sorted_ids[positions] != ids] = -1
+    return rows
+  
+  def _file_version(self, *paths: str) -> Tuple[int, ...]:
+    """mtime and size of every file backing the store, used to detect changes on disk"""
+    
+    version = []
+    for path in paths:
+      stat = Path(path).stat()
+      version += [stat.st_mtime_ns, stat.st_size]
+    return tuple(version)
   
   def query(self, query: str, top_k: int) -> list[Tuple[str, float]]:
     """Search the vectorstore and return k nearest neighbors"""
     
+    return self.query_batch([query], top_k)[0]
+  
+  def query_batch(self, queries: Sequence[str], top_k: int) -> list[list[Tuple[str, float]]]:
+    """Search the vectorstore for every query with one encode and one index search"""
+    
+    return self.search(self.encode_queries(queries), top_k)
+  
+  def search(self, query_vecs: np.ndarray, top_k: int) -> list[list[Tuple[str, float]]]:
+    """Search the vectorstore with a matrix of already encoded queries, one result list per row"""
+    
     if self.index is None:
       raise ValueError("Index is None, was it loaded or created?")
     if self.entities is None:
       raise ValueError("Entities is None, was it loaded or created?")
-    query_vec = self.model.encode([query], normalize_embeddings=True).astype("float32")
-    D, I = self.index.search(query_vec, top_k) #type: ignore
-    return [(self.entities[idx], score) for idx, score in zip(I[0], D[0])]
\ No newline at end of file
+    D, I = self.index.search(query_vecs, top_k) #type: ignore
+    results = []
+    for ids, scores in zip(I, D):
+      rows = self._rows_for(ids)
+      results.append([(self.entities[row], score) for row, score in zip(rows, scores) if row >= 0])
+    return results
\ No newline at end of file
@@ -4,7 +4,7 @@ import exitlogo from "../assets/exit.png";
 import { useState } from "react";
 
 
-const Chat = ({ content, sender, className, loading, cypher, data }) => {
+const Chat = ({ content, sender, className, loading, status, cypher, data }) => {
 
 	if (data === 0) {
 		data = "No Retrieved Data"
@@ -27,7 +27,7 @@ const Chat = ({ content, sender, className, loading, cypher, data }) => {
 			<div className={`flex justify-start w-full mt-[3%] ${className}`}>
 			<div className="w-[75%] flex justify-start">
 				<div className="flex items-end w-[105%] bg-gray-600 p-6 rounded-xl">
-					<span className="text-white font-sans animate-pulse">Loading...</span>
+					<span className="text-white font-sans animate-pulse">{status || "Loading..."}</span>
 				 </div>
 			 </div>
 		</div>
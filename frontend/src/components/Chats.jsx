@@ -1,6 +1,7 @@
 import React from 'react'
 import { useState } from "react";
 import Chat from "./Chat";
+import streamChat from "../streamChat";
 
 const Chats = () => {
 
@@ -28,23 +29,29 @@ const Chats = () => {
 			{ content: "", sender:"bot", loading: true}
 		])
 
-		try {
-			const response = await fetch('http://127.0.0.1:5000/api/chat', {
-				method: "POST",
-				headers: {
-					"Content-Type": "application/json",
-			},
-				body: JSON.stringify({ input: userMessage }),
-			});
-			const data = await response.json();
-			
+		// replaces the last (bot) chat with the result of update applied to it
+		const updateBotChat = (update) => {
 			setChats((prevChats) =>
 				prevChats.map((chat, index) =>
-					index === prevChats.length - 1
-						? { content: data.response, cypher: data.cypher, data: data.data, sender: "bot", loading: false }
-						: chat
+					index === prevChats.length - 1 ? { ...chat, ...update(chat) } : chat
 				)
 			);
+		};
+
+		try {
+			await streamChat(userMessage, (event) => {
+				if (event.type === "tool") {
+					updateBotChat(() => ({ status: `Searching with ${event.tool}...` }));
+				} else if (event.type === "retrieval") {
+					updateBotChat(() => ({ status: event.found ? "Writing answer..." : `No data from ${event.tool}...` }));
+				} else if (event.type === "token") {
+					updateBotChat((chat) => ({ content: chat.content + event.content, loading: false }));
+				} else if (event.type === "done") {
+					updateBotChat(() => ({ content: event.answer, cypher: "null", data: "null", loading: false }));
+				} else if (event.type === "error") {
+					throw new Error(event.message);
+				}
+			});
 		
 		} catch (error) {
 			setChats((prevChats) =>
@@ -64,7 +71,7 @@ const Chats = () => {
 			<div className='overflow-y-scroll overflow-x-hidden flex items-center flex-col w-full mb-[5%] scrollbar scrollbar-track-slate-800 scrollbar-thumb-slate-600'>
 			<div className={`${!chats.length ? `h-[0%]` : `max-h-[68vh]`} -x-hidden w-[70%]`}>
 			 {chats.map((chat, index) => (
-				<Chat key={index} content={chat.content} sender={chat.sender} loading={chat.loading} cypher={chat.cypher} data={chat.data}/>
+				<Chat key={index} content={chat.content} sender={chat.sender} loading={chat.loading} status={chat.status} cypher={chat.cypher} data={chat.data}/>
 			 ))}
 			</div>
 			</div>
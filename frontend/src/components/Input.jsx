@@ -1,5 +1,6 @@
 import React, { useState } from 'react';
 import Chat from './Chat';
+import streamChat from '../streamChat';
 
 const Input = ({ setChats }) => {
     const [query, setQuery] = useState('');
@@ -17,15 +18,24 @@ const Input = ({ setChats }) => {
         setQuery(tempQuery); // Now set query to tempQuery after the chat is added
 
         try {
-            const response = await fetch('http://127.0.0.1:5000/api/chat', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify({ input: tempQuery }),
+            // bot chat is added on the first token and grows as the answer streams in
+            let started = false;
+            await streamChat(tempQuery, (event) => {
+                if (event.type === 'token') {
+                    if (!started) {
+                        started = true;
+                        addChat({ content: event.content, sender: 'Bot' });
+                    } else {
+                        setChats((prevChats) =>
+                            prevChats.map((chat, index) =>
+                                index === prevChats.length - 1 ? { ...chat, content: chat.content + event.content } : chat
+                            )
+                        );
+                    }
+                } else if (event.type === 'error') {
+                    throw new Error(event.message);
+                }
             });
-            const data = await response.json();
-            addChat({ content: data, sender: 'Bot' });
         } catch (error) {
             // Handle error properly by accessing error.message
             addChat({ content: `Error: ${error.message}`, sender: 'Bot', type: 'Error' });
@@ -0,0 +1,63 @@
+// crypto.randomUUID only exists in secure contexts (https or localhost), the app can also be
+// served over plain http on a LAN, so fall back to getRandomValues and then to Math.random.
+const newSessionId = () => {
+	if (window.crypto?.randomUUID) {
+		return window.crypto.randomUUID();
+	}
+	if (window.crypto?.getRandomValues) {
+		const bytes = window.crypto.getRandomValues(new Uint8Array(16));
+		return Array.from(bytes, (byte) => byte.toString(16).padStart(2, "0")).join("");
+	}
+	return `${Date.now().toString(16)}-${Math.random().toString(16).slice(2)}`;
+};
+
+// The backend keeps conversation memory per session, one id per browser.
+const getSessionId = () => {
+	let sessionId = localStorage.getItem("vaxchatSessionId");
+	if (!sessionId) {
+		sessionId = newSessionId();
+		localStorage.setItem("vaxchatSessionId", sessionId);
+	}
+	return sessionId;
+};
+
+// Posts a query to /api/chat/stream and calls onEvent for every server-sent event
+// (tool, retrieval, token, done, error) as it arrives.
+const streamChat = async (input, onEvent) => {
+	const response = await fetch('http://127.0.0.1:5000/api/chat/stream', {
+		method: "POST",
+		headers: {
+			"Content-Type": "application/json",
+		},
+		body: JSON.stringify({ input, session_id: getSessionId() }),
+	});
+	if (!response.ok || !response.body) {
+		throw new Error(`chat stream failed with status ${response.status}`);
+	}
+
+	const reader = response.body.getReader();
+	const decoder = new TextDecoder();
+	let buffer = "";
+	while (true) {
+		const { value, done } = await reader.read();
+		if (done) {
+			break;
+		}
+		buffer += decoder.decode(value, { stream: true });
+		// events are separated by a blank line, the last piece may still be incomplete
+		const events = buffer.split("\n\n");
+		buffer = events.pop();
+		for (const event of events) {
+			const data = event
+				.split("\n")
+				.filter((line) => line.startsWith("data: "))
+				.map((line) => line.slice(6))
+				.join("\n");
+			if (data) {
+				onEvent(JSON.parse(data));
+			}
+		}
+	}
+};
+
+export default streamChat;
@@ -0,0 +1,102 @@
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+import sys
+import threading
+import time
+
+_MISSING = object()
+
+
+class LRUCache:
+  """Bounded, thread-safe LRU cache with an optional time to live and hit/miss counters. With max_bytes set,
+  entries are also evicted once the sizes reported by sizeof add up to more than max_bytes"""
+
+  def __init__(self, 
+               maxsize: int = 1024, 
+               ttl: Optional[float] = None, 
+               max_bytes: Optional[int] = None, 
+               sizeof: Optional[Callable[[Any], int]] = None) -> None:
+    if maxsize <= 0:
+      raise ValueError(f"in LRUCache, expected maxsize > 0 but got {maxsize}")
+    self.maxsize: int = maxsize
+    self.ttl: Optional[float] = ttl
+    self.max_bytes: Optional[int] = max_bytes
+    self.sizeof: Callable[[Any], int] = sizeof or sys.getsizeof
+    self.bytes: int = 0
+    self._data: OrderedDict[Hashable, tuple[float, Any, int]] = OrderedDict()
+    self._lock = threading.Lock()
+    self.hits: int = 0
+    self.misses: int = 0
+    self.evictions: int = 0
+    self.expirations: int = 0
+
+  def get(self, key: Hashable, default: Any = None) -> Any:
+    """returns the cached value and marks it recently used, default on a miss or expired entry"""
+
+    with self._lock:
+      entry = self._data.get(key, _MISSING)
+      if entry is _MISSING:
+        self.misses += 1
+        return default
+      stored_at, value, size = entry # type: ignore
+      if self.ttl is not None and time.monotonic() - stored_at > self.ttl:
+        del self._data[key]
+        self.bytes -= size
+        self.expirations += 1
+        self.misses += 1
+        return default
+      self._data.move_to_end(key)
+      self.hits += 1
+      return value
+
+  def put(self, key: Hashable, value: Any) -> None:
+    """stores value, evicting the least recently used entries past maxsize or max_bytes. Putting a key again also
+    refreshes its size, for values that grow in place"""
+
+    size = self.sizeof(value) if self.max_bytes is not None else 0
+    with self._lock:
+      previous = self._data.get(key)
+      if previous is not None:
+        self.bytes -= previous[2]
+      self._data[key] = (time.monotonic(), value, size)
+      self._data.move_to_end(key)
+      self.bytes += size
+      #the newest entry always stays, even when it alone is over max_bytes
+      while len(self._data) > self.maxsize or (self.max_bytes is not None and self.bytes > self.max_bytes and len(self._data) > 1):
+        _, (_, _, evicted_size) = self._data.popitem(last=False)
+        self.bytes -= evicted_size
+        self.evictions += 1
+
+  def invalidate(self, predicate: Optional[Callable[[Hashable], bool]] = None) -> int:
+    """drops every entry, or only the keys matching predicate, and returns how many were dropped"""
+
+    with self._lock:
+      if predicate is None:
+        dropped = len(self._data)
+        self._data.clear()
+        self.bytes = 0
+        return dropped
+      keys = [key for key in self._data if predicate(key)]
+      for key in keys:
+        self.bytes -= self._data.pop(key)[2]
+      return len(keys)
+
+  def stats(self) -> dict[str, float]:
+    """size, hit/miss counters and hit rate"""
+
+    with self._lock:
+      total = self.hits + self.misses
+      return {
+        "size": len(self._data),
+        "maxsize": self.maxsize,
+        "bytes": self.bytes,
+        "max_bytes": self.max_bytes,
+        "hits": self.hits,
+        "misses": self.misses,
+        "evictions": self.evictions,
+        "expirations": self.expirations,
+        "hit_rate": self.hits / total if total else 0.0,
+      }
+
+  def __len__(self) -> int:
+    return len(self._data)
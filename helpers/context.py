@@ -0,0 +1,136 @@
+from helpers.rerank import Reranker
+from typing import Any, Callable, Literal, Optional
+import json
+import math
+import re
+
+try:
+  import tiktoken
+except ImportError:
+  tiktoken = None
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def token_counter(model_encoding: str = "o200k_base") -> Callable[[str], int]:
+  """token counting function, exact with tiktoken installed, otherwise the usual ~4 characters per token estimate"""
+
+  if tiktoken is not None:
+    try:
+      encoding = tiktoken.get_encoding(model_encoding)
+      return lambda text: len(encoding.encode(text, disallowed_special=()))
+    except (KeyError, ValueError):
+      pass
+  return lambda text: math.ceil(len(text) / 4)
+
+
+class ContextBuilder:
+  """Packs retrieved records into a token budget for the final answer prompt. Records are split into chunks,
+  duplicates (and chunks contained in another chunk) are removed, chunks are ranked by relevance to the user query and
+  greedily packed best first, then emitted in their retrieval order"""
+
+  def __init__(self,
+               token_budget: int = 6000,
+               chunk_tokens: int = 300,
+               rerank_method: Literal["embedding", "bm25"] = "bm25",
+               model_encoding: str = "o200k_base") -> None:
+    self.token_budget: int = token_budget
+    self.chunk_tokens: int = chunk_tokens
+    self.reranker = Reranker(rerank_method)
+    self.count_tokens: Callable[[str], int] = token_counter(model_encoding)
+
+  def build(self, user_query: str, retrieved: list[Any], token_budget: Optional[int] = None) -> tuple[str, dict[str, Any]]:
+    """context text for the retrieved results and a report of what was kept and dropped. The builder is shared by
+    every session, so the report is returned rather than kept on it"""
+
+    budget = self.token_budget if token_budget is None else token_budget
+    #chunks of a sourced record (a pubmed article) keep the source so citations survive dedupe and packing
+    chunks = [f"{source} {chunk}" if source else chunk
+              for result in retrieved for source, record in self._records(result) for chunk in self._split(record)]
+    unique = self._dedupe(chunks)
+    tokens = [self.count_tokens(chunk) for chunk in unique]
+
+    kept: list[int] = []
+    used = 0
+    for i, _ in self.reranker.top(user_query, unique, len(unique)):
+      if used + tokens[i] <= budget:
+        kept.append(i)
+        used += tokens[i]
+    kept.sort()
+
+    total = sum(tokens)
+    report = {
+      "chunks": len(chunks),
+      "duplicates": len(chunks) - len(unique),
+      "kept_chunks": len(kept),
+      "dropped_chunks": len(unique) - len(kept),
+      "kept_tokens": used,
+      "dropped_tokens": total - used,
+      "token_budget": budget,
+    }
+    return "\n".join(unique[i] for i in kept), report
+
+  def _records(self, result: Any) -> list[tuple[str, str]]:
+    """(source, text) per retrieved record, lists of records (neo4j rows, pubmed articles) are split up. Pubmed
+    articles get their PMID as source, other records have none"""
+
+    if result is None or result == "":
+      return []
+    if isinstance(result, (list, tuple)):
+      records = [record for item in result for record in self._records(item)]
+      #capped graph results say when they are only a prefix of what matched
+      notice = getattr(result, "notice", "")
+      return records + [("", notice)] if notice else records
+    if isinstance(result, dict):
+      if "pmid" in result:
+        text = " ".join(str(value) for key, value in result.items() if key != "pmid" and value)
+        return [(f"[PMID {result['pmid']}]", text)] if text.strip() else []
+      return [("", json.dumps(result, default=str, ensure_ascii=False))]
+    return [("", line) for line in str(result).splitlines() if line.strip()]
+
+  def _split(self, record: str) -> list[str]:
+    """splits records over chunk_tokens at sentence boundaries, falling back to word windows"""
+
+    if self.count_tokens(record) <= self.chunk_tokens:
+      return [record]
+    chunks: list[str] = []
+    current = ""
+    for sentence in _SENTENCE_END.split(record):
+      candidate = f"{current} {sentence}" if current else sentence
+      if self.count_tokens(candidate) <= self.chunk_tokens:
+        current = candidate
+        continue
+      if current:
+        chunks.append(current)
+      if self.count_tokens(sentence) <= self.chunk_tokens:
+        current = sentence
+      else:
+        chunks.extend(self._word_windows(sentence))
+        current = ""
+    if current:
+      chunks.append(current)
+    return chunks
+
+  def _word_windows(self, text: str) -> list[str]:
+    words = text.split()
+    #tokens per word varies, size windows from this text's own ratio
+    words_per_chunk = max(1, int(len(words) * self.chunk_tokens / max(1, self.count_tokens(text))))
+    return [" ".join(words[i:i + words_per_chunk]) for i in range(0, len(words), words_per_chunk)]
+
+  def _dedupe(self, chunks: list[str]) -> list[str]:
+    """drops repeated chunks and chunks whose text is contained in a longer chunk, keeping retrieval order"""
+
+    normalized = [" ".join(chunk.casefold().split()) for chunk in chunks]
+    seen: set[str] = set()
+    candidates = []
+    for i, norm in enumerate(normalized):
+      if norm and norm not in seen:
+        seen.add(norm)
+        candidates.append(i)
+
+    by_length = sorted(candidates, key=lambda i: len(normalized[i]), reverse=True)
+    kept: list[int] = []
+    for i in by_length:
+      if not any(normalized[i] in normalized[j] for j in kept):
+        kept.append(i)
+    return [chunks[i] for i in sorted(kept)]
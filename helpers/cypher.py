@@ -1,12 +1,33 @@
 from helpers.llm import create_llm
 from helpers.ner import create_ner
-from embed_create.vector_store import VectorStore
+from embed_create.vector_store import VectorStore, entity_id
+from embed_create.lexical_index import LexicalIndex
+from helpers.cache import LRUCache
+from helpers.cypher_cache import CypherCache
+from helpers.graph_query import GraphQueryRunner, QueryRejected
 
 from spacy.tokens import Doc
-from neo4j import Driver, Query
+from neo4j import AsyncDriver, Driver, Query
 import neo4j
 from langchain_core.prompts import ChatPromptTemplate
+from typing import Optional
+import asyncio
 import json
+import time
+
+
+NAME_STORE_QUERIES: dict[str, str] = {
+  "host": "MATCH (n: HostName) return n.NAME",
+  "pathogen": "MATCH (n: PathogenName) return n.NAME",
+  "vaccine": "MATCH (n: VaccineName) return n.NAME",
+}
+
+
+def fetch_names(neo4j_driver: Driver, cypher_query: str, name_property: str = "n.NAME") -> list[str]:
+  """runs a name store query and returns the non empty names"""
+  
+  with neo4j_driver.session(default_access_mode=neo4j.READ_ACCESS) as session:
+    return [record[name_property] for record in session.run(Query(cypher_query)) if record[name_property]] # type: ignore
 
 
 class CypherAPI():
@@ -14,55 +35,208 @@ class CypherAPI():
                neo4j_driver: Driver, 
                debug: bool, vector_store_names: list[str], 
                cypher_queries: list[str], 
-               cypher_name_properties: list[str]):
+               cypher_name_properties: list[str],
+               cache_size: int = 4096,
+               cache_ttl: Optional[float] = 3600,
+               async_neo4j_driver: Optional[AsyncDriver] = None,
+               cypher_cache: Optional[CypherCache] = None,
+               use_cypher_cache: bool = True):
     self.neo4j_driver = neo4j_driver
+    self.async_neo4j_driver = async_neo4j_driver
+    self.graph = GraphQueryRunner(neo4j_driver, async_neo4j_driver, "vaxkg")
     self.helper_agent = create_llm()
     self.debug: bool = debug
     self.ner_model = create_ner()
     self.vector_store: dict[str, VectorStore] = {}
+    self.vector_store_sources: dict[str, tuple[str, str]] = {}
+    self.lexical_index: dict[str, LexicalIndex] = {}
+    self.encoded_count: int = 0
+    #(store name, entity text) -> (VaxKG name, score)
+    self.entity_cache = LRUCache(cache_size, cache_ttl)
+    self.cache_ttl: Optional[float] = cache_ttl
+    #normalized query -> generated cypher that ran and returned rows, recurring questions skip the llm
+    self.cypher_cache: Optional[CypherCache] = cypher_cache or (CypherCache() if use_cypher_cache else None)
     
     self._create_vectorstores(vector_store_names, cypher_queries, cypher_name_properties)
     
   def retrieve(self, user_query : str):
     """takes user query, normalizes it, converts into cypher, returns the retrieved data from neo4j"""
     
+    #pick up stores rewritten by update_vectorstores in another process
+    for store in self.vector_store.values():
+      store.refresh()
     normalized_query = self._normalize_query(user_query)
-    cypher_query = self._convert_to_cypher(normalized_query)
-    neo4j_data = self._run_cypher(cypher_query)
+    cached_query = self.cypher_cache.lookup(normalized_query) if self.cypher_cache is not None else None
+    start = time.perf_counter()
+    cypher_query = cached_query or self._convert_to_cypher(normalized_query)
+    llm_seconds = time.perf_counter() - start
+    try:
+      neo4j_data = self._run_cypher(cypher_query)
+    except QueryRejected as e:
+      #one rewrite with the plan check's feedback, a second rejection returns nothing rather than failing the answer
+      print(e)
+      self._evict_rejected(cached_query)
+      cached_query = None
+      start = time.perf_counter()
+      cypher_query = self._convert_to_cypher(normalized_query, e.prompt_hint)
+      llm_seconds = time.perf_counter() - start
+      try:
+        neo4j_data = self._run_cypher(cypher_query)
+      except QueryRejected as e:
+        print(e)
+        return []
+    if cached_query is None and neo4j_data and self.cypher_cache is not None:
+      self.cypher_cache.store(normalized_query, cypher_query, llm_seconds)
     if self.debug:
       print(neo4j_data)
     
     return neo4j_data
+  
+  async def aretrieve(self, user_query : str):
+    """retrieve for the asyncio serving path, entity normalization (cpu bound) runs in a worker thread while the 
+    llm call and the neo4j query are awaited"""
+    
+    for store in self.vector_store.values():
+      await asyncio.to_thread(store.refresh)
+    normalized_query = await asyncio.to_thread(self._normalize_query, user_query)
+    cached_query = None
+    if self.cypher_cache is not None:
+      cached_query = await asyncio.to_thread(self.cypher_cache.lookup, normalized_query)
+    start = time.perf_counter()
+    cypher_query = cached_query or await self._aconvert_to_cypher(normalized_query)
+    llm_seconds = time.perf_counter() - start
+    try:
+      neo4j_data = await self._arun_cypher(cypher_query)
+    except QueryRejected as e:
+      print(e)
+      await asyncio.to_thread(self._evict_rejected, cached_query)
+      cached_query = None
+      start = time.perf_counter()
+      cypher_query = await self._aconvert_to_cypher(normalized_query, e.prompt_hint)
+      llm_seconds = time.perf_counter() - start
+      try:
+        neo4j_data = await self._arun_cypher(cypher_query)
+      except QueryRejected as e:
+        print(e)
+        return []
+    if cached_query is None and neo4j_data and self.cypher_cache is not None:
+      await asyncio.to_thread(self.cypher_cache.store, normalized_query, cypher_query, llm_seconds)
+    if self.debug:
+      print(neo4j_data)
+    
+    return neo4j_data
+    
+  def _evict_rejected(self, cached_query: Optional[str]) -> None:
+    """drops reused cypher the plan check rejected, so similar questions don't hit it again. The accepted rewrite is
+    cached in its place once it returns rows"""
+    
+    if cached_query is not None and self.cypher_cache is not None:
+      self.cypher_cache.evict(cached_query)
     
   def _normalize_query(self, user_query : str) -> str:
     """takes user query with highlighted entities and normalizes it to VaxKG name conventions"""
     
     doc = self._run_ner(user_query)
     
-    #for each text, entity pair in doc.ents, we map the text into text indexed with entity, using a arbitrary distance.
     if self.debug:
       print("doc")
       print(doc)
-    #replace each text with new text
-    normalized_query = ""
-    for token in doc:
-      if token.ent_iob_ != "O":
-        #map and convert
-        index = token.ent_type_.lower()
-        if self.debug: 
-          print(index)
-        standardized_token = self.vector_store[index].query(token.text, 1)
-        if self.debug:
-          print(standardized_token)
-        normalized_query += " " + standardized_token[0][0]
+    
+    #multi token entities are mapped as one span, not word by word
+    spans = [ent for ent in doc.ents if ent.label_.lower() in self.vector_store]
+    mapped = self._map_entities([span.text for span in spans], [span.label_.lower() for span in spans])
+    replacements = {span.start: (span.end, mapped_text) for span, mapped_text in zip(spans, mapped)}
+    
+    #replace each entity span with its VaxKG name
+    parts = []
+    i = 0
+    while i < len(doc):
+      if i in replacements:
+        i, mapped_text = replacements[i]
+        parts.append(mapped_text)
       else:
-        normalized_query += " " + token.text
+        parts.append(doc[i].text)
+        i += 1
+    normalized_query = " ".join(parts)
         
     if self.debug:
       print(normalized_query)
     return normalized_query.strip()
   
   
+  def _map_entities(self, texts: list[str], labels: list[str]) -> list[str]:
+    """maps entity texts to their nearest VaxKG name, exact or fuzzy name matches skip the encoder, 
+    the rest get one encode for all texts and one search per label"""
+    
+    mapped = list(texts)
+    misses = []
+    for i, (text, label) in enumerate(zip(texts, labels)):
+      cached = self.entity_cache.get((label, text))
+      if cached is not None:
+        mapped[i] = cached[0]
+        continue
+      match = self._lexical(label).lookup(text)
+      if match is None:
+        misses.append(i)
+      else:
+        mapped[i] = match[0]
+        self.entity_cache.put((label, text), (match[0], match[1]))
+        if self.debug:
+          print(f"in _map_entities, {match[2]} match {text} -> {match[0]}")
+    if not misses:
+      return mapped
+    self.encoded_count += len(misses)
+    
+    #stores sharing an encoder share one forward pass
+    by_model: dict[str, list[int]] = {}
+    for i in misses:
+      by_model.setdefault(self.vector_store[labels[i]].model_name, []).append(i)
+    
+    for positions in by_model.values():
+      embeddings = self.vector_store[labels[positions[0]]].encode_queries([texts[i] for i in positions])
+      by_label: dict[str, list[int]] = {}
+      for row, i in enumerate(positions):
+        by_label.setdefault(labels[i], []).append(row)
+      for label, rows in by_label.items():
+        results = self.vector_store[label].search(embeddings[rows], 1)
+        for row, result in zip(rows, results):
+          if result:
+            mapped[positions[row]] = result[0][0]
+            self.entity_cache.put((label, texts[positions[row]]), (result[0][0], float(result[0][1])))
+        if self.debug:
+          print(label, results)
+    return mapped
+  
+  def _lexical(self, label: str) -> LexicalIndex:
+    """lexical index over the names in a store, rebuilt when the store was reloaded"""
+    
+    store = self.vector_store[label]
+    index = self.lexical_index.get(label)
+    if index is None or index.source_version != store.loaded_version:
+      index = LexicalIndex(store.entities, source_version=store.loaded_version)
+      self.lexical_index[label] = index
+    return index
+  
+  def lexical_stats(self) -> dict[str, dict[str, float]]:
+    """exact/fuzzy hit counters per store and how many entity texts still needed the encoder"""
+    
+    stats: dict[str, dict[str, float]] = {label: index.stats() for label, index in self.lexical_index.items()}
+    stats["encoder"] = {"encoded": self.encoded_count}
+    return stats
+  
+  def cache_stats(self) -> dict[str, dict[str, float]]:
+    """hit/miss counters of the entity mapping cache, each store's embedding cache, the generated cypher cache and the
+    query result cache"""
+    
+    stats = {"entity_mapping": self.entity_cache.stats()}
+    for name, store in self.vector_store.items():
+      stats[f"{name}_embedding"] = store.embedding_cache.stats()
+    if self.cypher_cache is not None:
+      stats["cypher"] = self.cypher_cache.stats()
+    if self.graph.cache is not None:
+      stats["results"] = self.graph.cache.stats()
+    return stats
+  
   def _run_ner(self, user_query) -> Doc:
     """runs the user query from NER model and provides doc with doc.ents annotations"""
     
@@ -75,16 +249,20 @@ class CypherAPI():
   def _run_cypher(self, query: str) -> list[dict]:
     """runs cypher query and returns data"""
     try:
-      with self.neo4j_driver.session(default_access_mode=neo4j.READ_ACCESS) as session:
-        q = Query(query) # type: ignore
-        retrieved_data = session.run(q)
-        results = retrieved_data.data()
-        if results is None:
-          raise ValueError("in _run_cypher, expected results but got None")
-        else:
-          return results
+      return self.graph.run(query)
+    except QueryRejected:
+      raise
     except Exception as e:
       raise Exception(f"in _run_cypher, got exception {e}")
+  
+  async def _arun_cypher(self, query: str) -> list[dict]:
+    """_run_cypher on the async driver"""
+    try:
+      return await self.graph.arun(query)
+    except QueryRejected:
+      raise
+    except Exception as e:
+      raise Exception(f"in _arun_cypher, got exception {e}")
     
     
   def _create_vectorstores(self, names: list[str], cypher_queries: list[str], cypher_name_properties: list[str] = []):
@@ -99,18 +277,43 @@ class CypherAPI():
       raise ValueError("in _create_vectorstores, expected lists names and cypher_queries to be same length")
 
     for cypher_query, name, query_name in zip(cypher_queries,names, cypher_name_properties):
-      self.vector_store[name] = VectorStore(name)
+      self.vector_store[name] = VectorStore(name, cache_ttl=self.cache_ttl)
+      #a rebuilt or reloaded store invalidates the mappings that point into it
+      self.vector_store[name].listeners.append(
+        lambda name=name: self.entity_cache.invalidate(lambda key: key[0] == name))
+      self.vector_store_sources[name] = (cypher_query, query_name)
       if self.vector_store[name].load():
         continue
       else:
-        results = self._run_cypher(cypher_query)
-        entities = [entity[query_name] for entity in results]
+        entities = fetch_names(self.neo4j_driver, cypher_query, query_name)
         self.vector_store[name].create_index(entities)
         self.vector_store[name].save()
+  
+  def update_vectorstores(self) -> dict[str, dict[str, int]]:
+    """re-reads the names behind each store, embedding only new names and dropping ones no longer in VaxKG"""
+    
+    stats = {}
+    for name, (cypher_query, query_name) in self.vector_store_sources.items():
+      entities = fetch_names(self.neo4j_driver, cypher_query, query_name)
+      stats[name] = self.vector_store[name].sync((entity_id(entity), entity) for entity in entities)
+      if self.debug:
+        print(f"in update_vectorstores, {name}: {stats[name]}")
+    return stats
         
-  def _convert_to_cypher(self, normalized_query: str) -> str:
-    """Takes in a normalized_query and returns a converted cypher query"""
+  def _convert_to_cypher(self, normalized_query: str, feedback: str = "") -> str:
+    """Takes in a normalized_query and returns a converted cypher query, feedback explains why a previous one was
+    rejected"""
     
+    llm_chain = self._cypher_chain()
+    final_response = llm_chain.invoke({"user_query": normalized_query, "feedback": feedback}).content
+    return self._parse_cypher(final_response)
+  
+  async def _aconvert_to_cypher(self, normalized_query: str, feedback: str = "") -> str:
+    llm_chain = self._cypher_chain()
+    response = await llm_chain.ainvoke({"user_query": normalized_query, "feedback": feedback})
+    return self._parse_cypher(response.content)
+  
+  def _cypher_chain(self):
     system_prompt = """
     You are a professional cypher expert, converting user queries into cypher. You will be provided a user query, please convert it into a cypher query that can best answer the user's question.
     You can be assured the entity names are standardized to the terms used in the database.
@@ -139,8 +342,7 @@ class CypherAPI():
     User Query: 
       "Find vaccines targeting pathogens that cause disease in humans." 
     Cypher Query:
-      MATCH (v:VaccineName)-[:TARGETS_PATHOGEN]->(p:PathogenName)
-      MATCH (h:HostName {{NAME: "Human"}})
+      MATCH (h:HostName {{NAME: "Human"}})<-[:TARGETS_HOST]-(v:VaccineName)-[:TARGETS_PATHOGEN]->(p:PathogenName)
       WHERE p.DISEASE_NAME IS NOT NULL AND trim(p.DISEASE_NAME) <> ""
       RETURN v.NAME AS Vaccine, p.NAME AS Pathogen, p.DISEASE_NAME AS DISEASE
       LIMIT 5
@@ -192,15 +394,18 @@ class CypherAPI():
     Thank you and do your best!
     """
     
-    human_prompt = "The user query is: {user_query}"
+    human_prompt = "The user query is: {user_query}{feedback}"
     
     prompt = ChatPromptTemplate([
       ("system", system_prompt),
       ("human", human_prompt)
     ])
     
-    llm_chain = prompt | self.helper_agent
-    final_response = llm_chain.invoke({"user_query": normalized_query}).content
+    return prompt | self.helper_agent
+  
+  def _parse_cypher(self, final_response) -> str:
+    """cypher query from the {"cypher": ...} llm response"""
+    
     cypher_query = None
     try:
       json_response = json.loads(final_response) # type: ignore
@@ -0,0 +1,159 @@
+from embed_create.model_registry import get_model
+
+from collections import OrderedDict
+from typing import Any, Optional
+import re
+import threading
+
+import numpy as np
+
+_STRING_LITERAL = re.compile(r"\"((?:[^\"\\]|\\.)*)\"|'((?:[^'\\]|\\.)*)'")
+#literals the prompt asks for on every query (empty / n/a filters), they say nothing about the entity asked for
+_FILTER_LITERALS = {"", "na", "n/a", "null", "none"}
+_NUMBER = re.compile(r"(?<![\w.$])\d+(?:\.\d+)?(?![\w.])")
+#LIMIT / SKIP values the llm picked by default, a count the user asked for is compared on the query text instead
+_PAGING = re.compile(r"\b(?:LIMIT|SKIP)\s+\d+", re.IGNORECASE)
+_WORD = re.compile(r"[a-z]+n['\u2019]t|[a-z]+")
+_NEGATIONS = {"not", "no", "without", "except", "excluding", "non", "never"}
+
+
+def normalize_query_text(text: str) -> str:
+  """exact layer key, queries differing only in case, spacing or trailing punctuation match"""
+
+  return " ".join(text.casefold().split()).rstrip("?.! ")
+
+
+class CypherCache:
+  """Cache of generated Cypher keyed by the normalized user query. An exact layer matches the query text, a semantic
+  layer matches the closest cached query by embedding cosine similarity above threshold. A semantic hit is only used
+  when every string and numeric literal of the cached Cypher also appears in the new query, both queries ask for the
+  same numbers (a different count means a different LIMIT) and carry the same negations, so a question about another
+  entity, count or a negated paraphrase doesn't get the old query"""
+
+  def __init__(self, model_name: str = "all-MiniLM-L6-v2", threshold: float = 0.92, maxsize: int = 2048) -> None:
+    self.model_name: str = model_name
+    self.threshold: float = threshold
+    self.maxsize: int = maxsize
+    #key -> (cypher, embedding, seconds the llm took to write it)
+    self._entries: OrderedDict[str, tuple[str, np.ndarray, float]] = OrderedDict()
+    self._matrix: Optional[np.ndarray] = None
+    self._matrix_keys: list[str] = []
+    self._lock = threading.Lock()
+    self.counts: dict[str, float] = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "rejected": 0, "stores": 0,
+                                     "evictions": 0, "saved_seconds": 0.0}
+
+  def lookup(self, normalized_query: str) -> Optional[str]:
+    """cached cypher for the query, None on a miss"""
+
+    key = normalize_query_text(normalized_query)
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is not None:
+        self._entries.move_to_end(key)
+        self.counts["exact_hits"] += 1
+        self.counts["saved_seconds"] += entry[2]
+        return entry[0]
+      if not self._entries:
+        self.counts["misses"] += 1
+        return None
+
+    embedding = self._embed(key)
+    with self._lock:
+      if self._matrix is None:
+        self._matrix_keys = list(self._entries)
+        self._matrix = np.stack([self._entries[k][1] for k in self._matrix_keys])
+      scores = self._matrix @ embedding
+      best = int(np.argmax(scores))
+      best_key = self._matrix_keys[best]
+      entry = self._entries.get(best_key)
+      if entry is None or scores[best] < self.threshold:
+        self.counts["misses"] += 1
+        return None
+      if not _reusable(best_key, entry[0], key):
+        self.counts["rejected"] += 1
+        self.counts["misses"] += 1
+        return None
+      self._entries.move_to_end(best_key)
+      self.counts["semantic_hits"] += 1
+      self.counts["saved_seconds"] += entry[2]
+      return entry[0]
+
+  def store(self, normalized_query: str, cypher_query: str, llm_seconds: float = 0.0) -> None:
+    """caches cypher that ran successfully for the query"""
+
+    key = normalize_query_text(normalized_query)
+    embedding = self._embed(key)
+    with self._lock:
+      self._entries[key] = (cypher_query, embedding, llm_seconds)
+      self._entries.move_to_end(key)
+      while len(self._entries) > self.maxsize:
+        self._entries.popitem(last=False)
+      self._matrix = None
+      self.counts["stores"] += 1
+
+  def evict(self, cypher_query: str) -> int:
+    """drops every entry caching cypher_query, for cypher that stopped being usable. Returns how many were dropped"""
+
+    with self._lock:
+      keys = [key for key, entry in self._entries.items() if entry[0] == cypher_query]
+      for key in keys:
+        del self._entries[key]
+      if keys:
+        self._matrix = None
+        self.counts["evictions"] += len(keys)
+      return len(keys)
+
+  def stats(self) -> dict[str, Any]:
+    """exact/semantic hit counts, hit rate and llm seconds saved"""
+
+    with self._lock:
+      hits = self.counts["exact_hits"] + self.counts["semantic_hits"]
+      lookups = hits + self.counts["misses"]
+      return {
+        **self.counts,
+        "size": len(self._entries),
+        "maxsize": self.maxsize,
+        "threshold": self.threshold,
+        "hit_rate": hits / lookups if lookups else 0.0,
+      }
+
+  def clear(self) -> None:
+    with self._lock:
+      self._entries.clear()
+      self._matrix = None
+
+  def _embed(self, text: str) -> np.ndarray:
+    model = get_model(self.model_name)
+    return model.encode([text], convert_to_numpy=True, normalize_embeddings=True)[0].astype(np.float32)
+
+
+def _reusable(cached_query: str, cypher_query: str, query: str) -> bool:
+  """whether cypher_query, written for cached_query, also answers query (both normalized)"""
+
+  return (_literals_in(cypher_query, query)
+          and _numbers(cached_query) == _numbers(query)
+          and _negations(cached_query) == _negations(query))
+
+
+def _literals_in(cypher_query: str, query: str) -> bool:
+  """whether every entity literal and every numeric literal outside LIMIT / SKIP of cypher_query appears in the
+  (normalized) query text"""
+
+  for match in _STRING_LITERAL.finditer(cypher_query):
+    literal = (match.group(1) if match.group(1) is not None else match.group(2)).strip().casefold()
+    if literal in _FILTER_LITERALS:
+      continue
+    if literal not in query:
+      return False
+  structure = _PAGING.sub(" ", _STRING_LITERAL.sub(" ", cypher_query))
+  return set(_NUMBER.findall(structure)) <= _numbers(query)
+
+
+def _numbers(query: str) -> set[str]:
+  return set(_NUMBER.findall(query))
+
+
+def _negations(query: str) -> set[str]:
+  #contractions (isn't, aren't, don't) count as "not"
+  words = ["not" if word.endswith(("n't", "n\u2019t")) else word for word in _WORD.findall(query)]
+  return {word for word in words if word in _NEGATIONS}
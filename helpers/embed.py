@@ -1,43 +1,82 @@
 from embed_create.vector_store import VectorStore
+from embed_create.stream_build import StreamingBuilder
 
+from typing import Iterator, Tuple
 from neo4j import Driver
 import neo4j
 
 class EmbedAPI():
   def __init__(self, 
                neo4j_client: Driver,
-               debug: bool):
+               debug: bool,
+               index_type: str = "flat",
+               batch_size: int = 2048):
     self.neo4j_driver = neo4j_client
     self.debug: bool = debug
-    self.vector_store: VectorStore = VectorStore("graph_embed")
+    self.batch_size: int = batch_size
+    self.vector_store: VectorStore = VectorStore("graph_embed", index_type=index_type)
     
   def retrieve(self, user_query: str, k: int):
     """takes user query, embeds it, and then searches the vector database retrieve k top results"""
     
-    if not self.vector_store.load():
+    #index stays resident between queries, refresh only reloads when the files change
+    if not self.vector_store.refresh():
       self._create_vectorstore()
     
     result = self.vector_store.query(user_query, k)
-    result_str = "".join(result_node_str for result_node_str, _ in result)
+    result_str = "\n".join(result_node_str for result_node_str, _ in result)
     return result_str
     
   def _create_vectorstore(self):
-    """retrieves all nodes and embeds them into a vectorstore"""
-    
-    nodes_text = self._fetch_nodes()
-    self.vector_store.create_index(nodes_text)
-    self.vector_store.save()
-    
-  def _fetch_nodes(self):
-    with self.neo4j_driver.session() as session:
-      result = session.run("MATCH (n) RETURN labels(n) as labels, properties(n) as props")
-      nodes = []
-      for node_expanded in result:
-        if self.debug:
-          print("in _fetch_nodes joining node")
-        labels = ":".join(node_expanded["labels"])
-        props = " ".join([f"{k}:{v}" for k,v in node_expanded["props"].items()])
-        nodes.append(f"{labels} {props}")
+    """streams all nodes out of neo4j in id pages and embeds them batch by batch, resuming an interrupted build"""
+    
+    builder = StreamingBuilder(self.vector_store, debug=self.debug)
+    start_id = builder.resume()
+    for next_id, node_ids, nodes_text in self._fetch_node_batches(start_id):
+      builder.add_batch(nodes_text, next_id, node_ids)
+    builder.finish()
+    
+  def update_vectorstore(self) -> dict[str, int]:
+    """embeds only the nodes added or changed since the last build and removes deleted ones"""
+    
+    if not self.vector_store.load():
+      self._create_vectorstore()
+      return {"added": len(self.vector_store.entities), "changed": 0, "removed": 0, "unchanged": 0}
+    
+    items = ((node_id, text) 
+             for _, node_ids, nodes_text in self._fetch_node_batches() 
+             for node_id, text in zip(node_ids, nodes_text))
+    stats = self.vector_store.sync(items, self.batch_size)
+    if self.debug:
+      print(f"in update_vectorstore, {stats}")
+    return stats
+    
+  def _fetch_node_batches(self, start_id: int = 0) -> Iterator[Tuple[int, list[int], list[str]]]:
+    """yields (next id, node ids, node strings) for each id range of batch_size, seeking nodes by id instead of scanning"""
+    
+    with self.neo4j_driver.session(default_access_mode=neo4j.READ_ACCESS) as session:
+      max_id = session.run("MATCH (n) RETURN max(id(n)) AS max_id").single()["max_id"] # type: ignore
+    if max_id is None:
+      return
+    
+    for range_start in range(start_id, max_id + 1, self.batch_size):
+      range_end = min(range_start + self.batch_size, max_id + 1)
+      with self.neo4j_driver.session(default_access_mode=neo4j.READ_ACCESS) as session:
+        result = session.run(
+          "MATCH (n) WHERE id(n) IN range($start, $end - 1) RETURN id(n) as id, labels(n) as labels, properties(n) as props",
+          start=range_start, end=range_end)
+        node_ids = []
+        nodes = []
+        for record in result:
+          node_ids.append(record["id"])
+          nodes.append(self._node_text(record["labels"], record["props"]))
       if self.debug:
-        print(nodes)
-      return nodes
\ No newline at end of file
+        print(f"in _fetch_node_batches, ids {range_start}-{range_end} returned {len(nodes)} nodes")
+      yield range_end, node_ids, nodes
+      
+  def _node_text(self, labels: list[str], props: dict) -> str:
+    """flattens a node into the string that gets embedded"""
+    
+    labels_str = ":".join(labels)
+    props_str = " ".join([f"{k}:{v}" for k,v in props.items()])
+    return f"{labels_str} {props_str}"
\ No newline at end of file
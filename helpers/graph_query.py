@@ -0,0 +1,413 @@
+from helpers.cache import LRUCache
+
+from neo4j import AsyncDriver, Driver, Query
+import neo4j
+
+from collections import Counter
+from typing import Any, Hashable, Iterable, Iterator, Optional
+import json
+import re
+import threading
+import time
+
+#string literals, backtick quoted names and comments, names and comments are matched so quotes inside them aren't
+#taken as literals and literals are matched so // inside them isn't taken as a comment
+_TOKEN = re.compile(r"`[^`]*`|\"((?:[^\"\\]|\\.)*)\"|'((?:[^'\\]|\\.)*)'|//[^\n]*|/\*.*?\*/", re.DOTALL)
+_ESCAPES = {"\\": "\\", "\"": "\"", "'": "'", "n": "\n", "t": "\t", "r": "\r", "b": "\b", "f": "\f"}
+_ESCAPE = re.compile(r"\\(u[0-9a-fA-F]{4}|.)")
+
+
+def _unescape(literal: str) -> str:
+  def replace(match: re.Match) -> str:
+    escape = match.group(1)
+    if escape.startswith("u") and len(escape) == 5:
+      return chr(int(escape[1:], 16))
+    return _ESCAPES.get(escape, escape)
+  return _ESCAPE.sub(replace, literal)
+
+
+def parameterize(cypher_query: str) -> tuple[str, dict[str, str]]:
+  """Lifts string literals into $params and canonicalizes whitespace, so queries with the same shape but different
+  entities share one query text and Neo4j reuses the compiled plan. Equal literals share a parameter. Comments are
+  dropped, collapsed onto one line a // comment would swallow the rest of the query"""
+
+  params: dict[str, str] = {}
+  names: dict[str, str] = {}
+  parts: list[str] = []
+  #query text since the last literal or name, a comment becomes a space in it
+  text = ""
+  position = 0
+  for match in _TOKEN.finditer(cypher_query):
+    text += cypher_query[position:match.start()]
+    position = match.end()
+    if match.group(0).startswith("/"):
+      text += " "
+      continue
+    parts.append(_collapse(text))
+    text = ""
+    if match.group(0).startswith("`"):
+      parts.append(match.group(0))
+    else:
+      value = _unescape(match.group(1) if match.group(1) is not None else match.group(2))
+      if value not in names:
+        names[value] = f"p{len(names)}"
+        params[names[value]] = value
+      parts.append(f"${names[value]}")
+  parts.append(_collapse(text + cypher_query[position:]))
+  return "".join(parts).strip().rstrip(";").strip(), params
+
+
+def _freeze(params: dict[str, str]) -> tuple[tuple[str, str], ...]:
+  return tuple(sorted(params.items()))
+
+
+def _collapse(text: str) -> str:
+  """outside literals and quoted names whitespace is only layout"""
+  return re.sub(r"\s+", " ", text)
+
+
+#answered from the count store, cheap enough to probe every version_interval seconds
+VERSION_QUERIES = ("MATCH (n) RETURN count(n) AS count", "MATCH ()-[r]->() RETURN count(r) AS count")
+
+
+#keywords of a parameterized template, literals are already lifted out and names are masked before matching
+_RETURN = re.compile(r"\bRETURN\b", re.IGNORECASE)
+_LIMIT = re.compile(r"\bLIMIT\b", re.IGNORECASE)
+_UNION = re.compile(r"\bUNION\b", re.IGNORECASE)
+_NAME = re.compile(r"`[^`]*`")
+_BRACES = re.compile(r"\{[^{}]*\}")
+
+
+def _needs_limit(template: str) -> bool:
+  """whether the template's final top level RETURN has no LIMIT. Statements without a top level RETURN (procedure
+  calls) and UNIONs, where a LIMIT would only bind the last part, are left alone"""
+
+  masked = _NAME.sub(lambda match: "_" * len(match.group(0)), template)
+  if _UNION.search(masked):
+    return False
+  final_return = None
+  for match in _RETURN.finditer(masked):
+    #RETURNs inside CALL { } / EXISTS { } subqueries are nested in braces
+    if masked.count("{", 0, match.start()) == masked.count("}", 0, match.start()):
+      final_return = match.start()
+  if final_return is None:
+    return False
+  tail = masked[final_return:]
+  while _BRACES.search(tail):
+    tail = _BRACES.sub(" ", tail)
+  return not _LIMIT.search(tail)
+
+
+class QueryRejected(ValueError):
+  """The pre-flight plan check refused a query, feedback says why in terms the query writer can act on"""
+
+  def __init__(self, graph: str, template: str, feedback: str) -> None:
+    super().__init__(f"in GraphQueryRunner {graph}, rejected the query: {feedback}")
+    self.template: str = template
+    self.feedback: str = feedback
+
+  @property
+  def prompt_hint(self) -> str:
+    """appended to the query writer's prompt when it regenerates"""
+    return f"\nA previous query was rejected before running: {self.feedback}. Write a different query."
+
+
+def plan_operators(plan: Optional[dict[str, Any]]) -> Iterator[tuple[str, float]]:
+  """(operator type, estimated rows) of every operator in an EXPLAIN plan"""
+
+  stack = [plan] if plan else []
+  while stack:
+    operator = stack.pop()
+    yield operator.get("operatorType", "").split("@")[0], float(operator.get("args", {}).get("EstimatedRows", 0))
+    stack.extend(operator.get("children", []))
+
+
+def _result_bytes(rows: Any) -> int:
+  return len(json.dumps(rows, default=str))
+
+
+class CappedResult(list):
+  """Rows of a query read under a row and byte budget. truncated says whether the budget cut the result off and
+  reason which budget ("rows" or "bytes")"""
+
+  def __init__(self, rows: Iterable[dict[str, Any]] = (), truncated: bool = False, reason: Optional[str] = None,
+               nbytes: Optional[int] = None) -> None:
+    super().__init__(rows)
+    self.truncated: bool = truncated
+    self.reason: Optional[str] = reason
+    self.bytes: int = _result_bytes(self) if nbytes is None else nbytes
+
+  def copy(self) -> "CappedResult":
+    """new list of new row dicts with the same flags, callers can change it without touching the original"""
+    return CappedResult([dict(row) for row in self], self.truncated, self.reason, self.bytes)
+
+  @property
+  def notice(self) -> str:
+    """tells the model the rows are a prefix of the full result"""
+    if not self.truncated:
+      return ""
+    return f"(query result truncated to the first {len(self)} rows by the {self.reason} budget, more rows matched)"
+
+
+class ResultCache:
+  """Byte budgeted LRU of query results keyed by (graph, template, params), shared by every GraphQueryRunner.
+  A graph's entries are dropped when its dataset version (node and relationship counts) changes"""
+
+  def __init__(self, max_bytes: int = 128 * 1024 * 1024, maxsize: int = 10000, ttl: Optional[float] = None) -> None:
+    self.entries = LRUCache(maxsize, ttl, max_bytes, sizeof=lambda rows: rows.bytes)
+    self.versions: dict[str, Any] = {}
+    self.template_counts: dict[tuple[str, str], list[int]] = {}
+    self._lock = threading.Lock()
+
+  def get(self, key: tuple[str, str, Hashable]) -> Optional[CappedResult]:
+    rows = self.entries.get(key)
+    with self._lock:
+      counts = self.template_counts.setdefault(key[:2], [0, 0])
+      counts[0 if rows is not None else 1] += 1
+    return rows.copy() if rows is not None else None
+
+  def put(self, key: tuple[str, str, Hashable], rows: list[dict[str, Any]]) -> None:
+    """caches a copy, the caller keeps rows and may change them"""
+    self.entries.put(key, rows.copy() if isinstance(rows, CappedResult) else CappedResult(dict(row) for row in rows))
+
+  def check_version(self, graph: str, version: Any) -> bool:
+    """records the graph's dataset version, dropping its entries when it changed. True if they were dropped"""
+
+    with self._lock:
+      previous = self.versions.get(graph)
+      self.versions[graph] = version
+    if previous is None or previous == version:
+      return False
+    self.entries.invalidate(lambda key: key[0] == graph) # type: ignore
+    return True
+
+  def stats(self, top: int = 10) -> dict[str, Any]:
+    """size and hit counters, plus the hit ratio of the most requested templates"""
+
+    with self._lock:
+      templates = sorted(self.template_counts.items(), key=lambda item: sum(item[1]), reverse=True)[:top]
+    return {
+      **self.entries.stats(),
+      "versions": dict(self.versions),
+      "templates": [
+        {"graph": graph, "template": template, "hits": hits, "misses": misses, "hit_ratio": hits / (hits + misses)}
+        for (graph, template), (hits, misses) in templates
+      ],
+    }
+
+
+#one memory budget for every graph in the process
+result_cache = ResultCache()
+
+
+class GraphQueryRunner:
+  """Runs LLM generated read queries for one graph, shared by CypherAPI and SemmedAPI. Queries are parameterized
+  before they reach Neo4j and the distinct templates are counted. The graphs are read only reference data, so
+  results are served from cache until the graph's dataset version changes. Records are read lazily under max_rows and
+  max_bytes, a query without a LIMIT gets one and the rest of an oversized result is discarded on the server.
+  Before a template first runs its EXPLAIN plan is checked: scans of every node, large cartesian products and steps
+  estimated past max_estimated_rows raise QueryRejected. timeout bounds each transaction on the server"""
+
+  def __init__(self, 
+               driver: Driver, 
+               async_driver: Optional[AsyncDriver] = None, 
+               name: str = "neo4j",
+               cache: Optional[ResultCache] = result_cache,
+               version_interval: float = 60.0,
+               max_rows: int = 200,
+               max_bytes: int = 256 * 1024,
+               explain: bool = True,
+               max_estimated_rows: float = 1_000_000,
+               max_cartesian_rows: float = 10_000,
+               timeout: Optional[float] = 15.0) -> None:
+    self.driver = driver
+    self.async_driver = async_driver
+    self.name = name
+    self.cache = cache
+    self.version_interval = version_interval
+    self.version_checked: float = 0.0
+    self.max_rows: int = max_rows
+    self.max_bytes: int = max_bytes
+    self.templates: Counter[str] = Counter()
+    #reason -> queries cut off by that budget
+    self.truncations: Counter[str] = Counter()
+    self.explain: bool = explain
+    self.max_estimated_rows: float = max_estimated_rows
+    self.max_cartesian_rows: float = max_cartesian_rows
+    self.timeout: Optional[float] = timeout
+    #template -> rejection feedback, "" when the plan passed. Parameters only shift the estimates
+    self.verdicts = LRUCache(4096)
+    #operator -> queries rejected because of it
+    self.rejections: Counter[str] = Counter()
+    self._lock = threading.Lock()
+
+  def run(self, cypher_query: str) -> CappedResult:
+    """parameterized read query, rows as dicts"""
+
+    template, params = self._prepare(cypher_query)
+    key = (self.name, template, _freeze(params))
+    if self.cache is not None:
+      if self._version_due():
+        if self.cache.check_version(self.name, self._read_version()):
+          #estimates move with the data, plans are checked again
+          self.verdicts.invalidate(lambda template: True)
+      rows = self.cache.get(key)
+      if rows is not None:
+        return rows
+
+    with self.driver.session(default_access_mode=neo4j.READ_ACCESS, fetch_size=self.max_rows + 1) as session:
+      if self._needs_review(template):
+        plan = session.run(Query(f"EXPLAIN {template}", timeout=self.timeout), params).consume().plan # type: ignore
+        self._review(template, plan)
+      result = session.run(Query(template, timeout=self.timeout), params) # type: ignore
+      rows: list[dict[str, Any]] = []
+      used = 0
+      reason = None
+      for record in result:
+        row = record.data()
+        size = _result_bytes(row) + 1
+        reason = self._cutoff(len(rows), used + size)
+        if reason is not None:
+          break
+        rows.append(row)
+        used += size
+      #discards whatever the server still holds instead of pulling it
+      result.consume()
+    rows = self._capped(rows, reason, used)
+    if self.cache is not None:
+      self.cache.put(key, rows)
+    return rows
+
+  async def arun(self, cypher_query: str) -> CappedResult:
+    """run on the async driver"""
+
+    if self.async_driver is None:
+      raise ValueError(f"in GraphQueryRunner {self.name}, expected an async_driver but got None")
+    template, params = self._prepare(cypher_query)
+    key = (self.name, template, _freeze(params))
+    if self.cache is not None:
+      if self._version_due():
+        if self.cache.check_version(self.name, await self._aread_version()):
+          #estimates move with the data, plans are checked again
+          self.verdicts.invalidate(lambda template: True)
+      rows = self.cache.get(key)
+      if rows is not None:
+        return rows
+
+    async with self.async_driver.session(default_access_mode=neo4j.READ_ACCESS, fetch_size=self.max_rows + 1) as session:
+      if self._needs_review(template):
+        explained = await session.run(Query(f"EXPLAIN {template}", timeout=self.timeout), params) # type: ignore
+        self._review(template, (await explained.consume()).plan)
+      result = await session.run(Query(template, timeout=self.timeout), params) # type: ignore
+      rows: list[dict[str, Any]] = []
+      used = 0
+      reason = None
+      async for record in result:
+        row = record.data()
+        size = _result_bytes(row) + 1
+        reason = self._cutoff(len(rows), used + size)
+        if reason is not None:
+          break
+        rows.append(row)
+        used += size
+      await result.consume()
+    rows = self._capped(rows, reason, used)
+    if self.cache is not None:
+      self.cache.put(key, rows)
+    return rows
+
+  def stats(self) -> dict[str, Any]:
+    """how many queries ran, how many distinct templates they used (most common first) and how many were truncated
+    or rejected"""
+
+    with self._lock:
+      return {
+        "queries": sum(self.templates.values()),
+        "templates": len(self.templates),
+        "top_templates": self.templates.most_common(10),
+        "truncated": dict(self.truncations),
+        "max_rows": self.max_rows,
+        "max_bytes": self.max_bytes,
+        "rejected": dict(self.rejections),
+      }
+
+  def _version_due(self) -> bool:
+    with self._lock:
+      now = time.monotonic()
+      if now - self.version_checked < self.version_interval:
+        return False
+      self.version_checked = now
+      return True
+
+  def _read_version(self) -> tuple[int, ...]:
+    """node and relationship counts"""
+
+    with self.driver.session(default_access_mode=neo4j.READ_ACCESS) as session:
+      return tuple(session.run(Query(query)).single()["count"] for query in VERSION_QUERIES) # type: ignore
+
+  async def _aread_version(self) -> tuple[int, ...]:
+    counts = []
+    async with self.async_driver.session(default_access_mode=neo4j.READ_ACCESS) as session: # type: ignore
+      for query in VERSION_QUERIES:
+        result = await session.run(Query(query)) # type: ignore
+        counts.append((await result.single())["count"])
+    return tuple(counts)
+
+  def _needs_review(self, template: str) -> bool:
+    """False once the template's plan passed, raises the stored rejection for a template that failed"""
+
+    if not self.explain:
+      return False
+    verdict = self.verdicts.get(template)
+    if verdict is None:
+      return True
+    if verdict:
+      raise QueryRejected(self.name, template, verdict)
+    return False
+
+  def _review(self, template: str, plan: Optional[dict[str, Any]]) -> None:
+    """checks an EXPLAIN plan against the cost ceilings, raising QueryRejected with feedback for the query writer"""
+
+    feedback = ""
+    operator = ""
+    for operator, estimated_rows in plan_operators(plan):
+      if operator == "AllNodesScan":
+        feedback = "it scans every node in the graph, give every node pattern a label"
+      elif operator == "CartesianProduct" and estimated_rows > self.max_cartesian_rows:
+        feedback = (f"it builds a cartesian product of about {estimated_rows:,.0f} rows from MATCH patterns that "
+                    "aren't connected, connect them through a relationship or anchor each on a specific entity")
+      elif estimated_rows > self.max_estimated_rows:
+        feedback = (f"its {operator} step is estimated at {estimated_rows:,.0f} rows, more than the "
+                    f"{self.max_estimated_rows:,.0f} allowed, filter on a specific entity before expanding")
+      if feedback:
+        break
+    self.verdicts.put(template, feedback)
+    if feedback:
+      with self._lock:
+        self.rejections[operator] += 1
+      raise QueryRejected(self.name, template, feedback)
+
+  def _cutoff(self, rows: int, nbytes: int) -> Optional[str]:
+    """the budget the next row would break, None while it fits"""
+
+    if rows >= self.max_rows:
+      return "rows"
+    if nbytes > self.max_bytes:
+      return "bytes"
+    return None
+
+  def _capped(self, rows: list[dict[str, Any]], reason: Optional[str], used: int) -> CappedResult:
+    if reason is not None:
+      with self._lock:
+        self.truncations[reason] += 1
+      print(f"in GraphQueryRunner {self.name}, result cut off after {len(rows)} rows by the {reason} budget")
+    return CappedResult(rows, reason is not None, reason, used + 1)
+
+  def _prepare(self, cypher_query: str) -> tuple[str, dict[str, str]]:
+    template, params = parameterize(cypher_query)
+    #one row past max_rows tells a result that fits from one that was cut off
+    if _needs_limit(template):
+      template = f"{template} LIMIT {self.max_rows + 1}"
+    with self._lock:
+      self.templates[template] += 1
+    return template, params
@@ -0,0 +1,119 @@
+from typing import IO, Iterable, Optional, Union
+from xml.etree import ElementTree as ET
+import io
+import re
+
+#subtrees whose text never reaches the prompt
+DROP_TAGS = {
+  "ref-list", "table-wrap", "table", "fig", "fig-group", "graphic", "media", "supplementary-material",
+  "disp-formula", "inline-formula", "xref", "fn-group", "ack", "back", "object-id",
+}
+#elements that start a new line of text, their words mustn't run into the text around them
+BLOCK_TAGS = {"p", "list", "list-item", "def-list", "def-item", "title", "sec", "boxed-text"}
+DEFAULT_SECTIONS = ("title", "abstract", "body")
+_SPACE_BEFORE_PUNCT = re.compile(r"\s+([,.;:)\]])")
+
+
+def _local(tag: str) -> str:
+  """tag without its namespace"""
+
+  return tag.rsplit("}", 1)[-1]
+
+
+def _text(elem: ET.Element) -> str:
+  """text of elem and its children, skipping dropped subtrees but keeping their tails"""
+
+  parts = [elem.text or ""]
+  for child in elem:
+    tag = _local(child.tag)
+    if tag in BLOCK_TAGS:
+      parts.append(f" {_text(child)} ")
+    elif tag not in DROP_TAGS:
+      parts.append(_text(child))
+    parts.append(child.tail or "")
+  return _SPACE_BEFORE_PUNCT.sub(r"\1", " ".join("".join(parts).split()))
+
+
+def extract_pmc_text(source: Union[bytes, IO[bytes]],
+                     sections: Iterable[str] = DEFAULT_SECTIONS,
+                     body_sections: Optional[Iterable[str]] = None,
+                     max_chars: Optional[int] = None) -> str:
+  """Streams PMC JATS xml and returns the title, abstract and body sections as plain text.
+  References, tables, figures and formulas are dropped, body_sections keeps only top level sections whose
+  title contains one of the given words, and max_chars stops parsing once that much text is collected"""
+
+  if isinstance(source, (bytes, bytearray)):
+    source = io.BytesIO(source)
+  sections = set(sections)
+  body_filter = [word.casefold() for word in body_sections] if body_sections else None
+
+  title = ""
+  abstract: list[str] = []
+  body: list[tuple[str, list[str]]] = []
+  stack: list[str] = []
+  sec_titles: list[str] = []
+  size = 0
+
+  for event, elem in ET.iterparse(source, events=("start", "end")):
+    tag = _local(elem.tag)
+    if event == "start":
+      stack.append(tag)
+      if tag == "sec" and "body" in stack:
+        sec_titles.append("")
+      continue
+
+    stack.pop()
+    dropped = any(parent in DROP_TAGS for parent in stack)
+
+    if tag == "article-title" and "title-group" in stack and "article-meta" in stack and not title:
+      title = _text(elem)
+    elif tag == "title" and stack and stack[-1] == "sec" and "body" in stack and sec_titles:
+      sec_titles[-1] = _text(elem)
+    elif tag == "p" and "p" in stack:
+      #a paragraph nested in another (list items, boxed text) is part of its parent's text, kept until the parent ends
+      pass
+    elif tag == "p" and not dropped:
+      text = _text(elem)
+      if text and "abstract" in stack and "article-meta" in stack and "abstract" in sections:
+        abstract.append(text)
+        size += len(text)
+      elif text and "body" in stack and "body" in sections and _keep_section(sec_titles, body_filter):
+        heading = " > ".join(sec_title for sec_title in sec_titles if sec_title)
+        if not body or body[-1][0] != heading:
+          body.append((heading, []))
+        body[-1][1].append(text)
+        size += len(text)
+      elem.clear()
+    elif tag == "sec" and "body" in stack and sec_titles:
+      sec_titles.pop()
+      elem.clear()
+    elif tag in DROP_TAGS:
+      #clear() also resets the tail, which belongs to the surrounding paragraph
+      tail = elem.tail
+      elem.clear()
+      elem.tail = tail
+    elif tag == "article":
+      #only the first article of a pmc-articleset
+      break
+
+    if max_chars is not None and size >= max_chars:
+      break
+
+  parts = []
+  if title and "title" in sections:
+    parts.append(f"Title: {title}")
+  if abstract:
+    parts.append("Abstract: " + " ".join(abstract))
+  for heading, paragraphs in body:
+    parts.append((f"## {heading}\n" if heading else "") + "\n".join(paragraphs))
+  text = "\n\n".join(parts)
+  return text[:max_chars] if max_chars is not None else text
+
+
+def _keep_section(sec_titles: list[str], body_filter: Optional[list[str]]) -> bool:
+  """whether paragraphs under the current section path pass the body_sections filter"""
+
+  if body_filter is None:
+    return True
+  top_level = sec_titles[0].casefold() if sec_titles else ""
+  return any(word in top_level for word in body_filter)
@@ -1,32 +1,109 @@
 from helpers.llm import create_llm
+from helpers.rate_limit import TokenBucket, ncbi_rate
+from helpers.pubmed_cache import PubmedCache
+from helpers.pmc_parse import DEFAULT_SECTIONS, extract_pmc_text
+from helpers.rerank import Reranker
 
-from typing import Literal
+from typing import Iterable, Literal, Optional
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 from Bio import Entrez
+import json
+import os
+import re
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
 from xml.etree import ElementTree as ET
 from langchain_core.prompts import ChatPromptTemplate
 
+IDCONV_URL = "https://www.ncbi.nlm.nih.gov/pmc/utils/idconv/v1.0/"
+#the async path calls E-utilities directly, Bio.Entrez only does blocking io
+ESEARCH_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi"
+EFETCH_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi"
+IDCONV_BATCH_SIZE = 200
+
+
+class PubmedResults(list):
+  """Articles as {"pmid": ..., "abstract" | "full-text": ...} dicts, so the context builder can chunk and cite them
+  per article. Prints as the flat text the prompts take"""
+
+  def __str__(self) -> str:
+    return str(list(self)).replace('{', "").replace('}', "")
+
 class PubmedAPI():
-  def __init__(self, email : str, debug : bool = False):
+  def __init__(self, 
+               email : str, 
+               debug : bool = False, 
+               api_key: Optional[str] = None, 
+               efetch_batch_size: int = 200, 
+               max_workers: int = 3,
+               cache: Optional[PubmedCache] = None,
+               use_cache: bool = True,
+               fulltext_sections: Iterable[str] = DEFAULT_SECTIONS,
+               body_sections: Optional[Iterable[str]] = None,
+               fulltext_max_chars: Optional[int] = None,
+               candidate_pool: int = 3,
+               rerank_method: Literal["embedding", "bm25"] = "embedding",
+               llm_filter: bool = True):
     self.email = email
     Entrez.email = email
+    self.api_key = api_key or os.getenv("NCBI_API_KEY")
+    if self.api_key:
+      Entrez.api_key = self.api_key
+    #shared by every NCBI call so concurrent fetches stay under the 3 (10 with key) requests/second limit
+    self.rate_limiter = TokenBucket(ncbi_rate(self.api_key))
+    self.efetch_batch_size: int = efetch_batch_size
+    self.max_workers: int = max_workers
+    #keep-alive session, one pooled connection per worker
+    self.http = requests.Session()
+    self.http.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=max_workers))
+    #created on first async call so it belongs to the serving event loop
+    self.ahttp: Optional[httpx.AsyncClient] = None
+    self.cache: Optional[PubmedCache] = cache or (PubmedCache() if use_cache else None)
+    #which parts of a pmc article reach the prompt, e.g. body_sections=["results", "discussion"]
+    self.fulltext_sections: tuple[str, ...] = tuple(fulltext_sections)
+    self.body_sections: Optional[tuple[str, ...]] = tuple(body_sections) if body_sections else None
+    self.fulltext_max_chars: Optional[int] = fulltext_max_chars
+    #search fetches candidate_pool times the requested articles and keeps the locally best ranked ones
+    self.candidate_pool: int = candidate_pool
+    self.reranker = Reranker(rerank_method)
+    self.llm_filter: bool = llm_filter
     
     self.helper_agent = create_llm()
     self.decider_agent = create_llm("AzureOpenAI-4o-mini")
     self.debug = debug
     
   
-  def search(self, user_query : str, number_to_retrieve : int, mode : Literal["abstract", "full"] = "abstract") -> str:
-    """searches PubMed and retrieves relevant text to answer user query"""
+  def prewarm(self, terms: list[str], number_to_retrieve: int = 5, mode : Literal["abstract", "full"] = "abstract") -> dict[str, float]:
+    """fills the cache for known hot search terms so their first real search doesn't touch NCBI"""
+    
+    for term in terms:
+      if mode == "full":
+        self._fetch_fulltext(term, number_to_retrieve)
+      else:
+        self._fetch_abstracts(term, number_to_retrieve)
+    return self.cache.stats() if self.cache is not None else {}
+  
+  def search(self, user_query : str, number_to_retrieve : int, mode : Literal["abstract", "full"] = "abstract") -> PubmedResults:
+    """searches PubMed and retrieves relevant text to answer user query, a wider candidate pool is reranked locally 
+    and only the top number_to_retrieve reach the optional llm filter. In full mode the candidates are ranked on their 
+    abstracts and only the kept articles' full text is downloaded"""
+    
+    if (number_to_retrieve > 15):
+      raise ValueError(f'number_to_retrieve with value {number_to_retrieve} is quite high, 15 is reasonable limit to maintain context.')
     
     #rephrased_user_query = self._rephrase_user_query(user_query)
     rephrased_user_query = user_query
+    candidate_count = number_to_retrieve * self.candidate_pool
     
     if mode == "abstract":
-      pmids_and_text = self._fetch_abstracts(rephrased_user_query, number_to_retrieve)
+      pmids_and_text = self._fetch_abstracts(rephrased_user_query, candidate_count)
+      if pmids_and_text:
+        pmids_and_text = self._rerank(user_query, pmids_and_text, number_to_retrieve)
       
     elif mode == "full":
-      pmids_and_text = self._fetch_fulltext(rephrased_user_query, number_to_retrieve)
+      pmids_and_text = self._fetch_fulltext(rephrased_user_query, number_to_retrieve, candidate_count)
       
     else:
       raise ValueError(f'In search, mode with value {mode} is invalid, must be "abstract" or "full"')
@@ -34,6 +111,62 @@ class PubmedAPI():
     if not pmids_and_text:
       raise ValueError(f"In search, expected pmid_and_text to have value but it is None")
     
+    if self.llm_filter:
+      pmids_and_text = self._llm_filter(user_query, pmids_and_text)
+    return self._format_results(pmids_and_text)
+  
+  async def asearch(self, user_query : str, number_to_retrieve : int, mode : Literal["abstract", "full"] = "abstract") -> PubmedResults:
+    """search for the asyncio serving path, NCBI requests and the llm filter are awaited instead of blocking"""
+    
+    if (number_to_retrieve > 15):
+      raise ValueError(f'number_to_retrieve with value {number_to_retrieve} is quite high, 15 is reasonable limit to maintain context.')
+    
+    candidate_count = number_to_retrieve * self.candidate_pool
+    if mode == "abstract":
+      pmids_and_text = await self._afetch_abstracts(user_query, candidate_count)
+      if pmids_and_text:
+        #reranking is cpu bound, keep it off the event loop
+        pmids_and_text = await asyncio.to_thread(self._rerank, user_query, pmids_and_text, number_to_retrieve)
+    elif mode == "full":
+      pmids_and_text = await self._afetch_fulltext(user_query, number_to_retrieve, candidate_count)
+    else:
+      raise ValueError(f'In asearch, mode with value {mode} is invalid, must be "abstract" or "full"')
+    
+    if not pmids_and_text:
+      raise ValueError("In asearch, expected pmid_and_text to have value but it is None")
+    
+    if self.llm_filter:
+      llm_chain = self._llm_filter_chain()
+      response = await llm_chain.ainvoke({"user_query": user_query, "pmids_and_text": pmids_and_text})
+      pmids_and_text = self._keep_filtered(response.content, pmids_and_text)
+    return self._format_results(pmids_and_text)
+  
+  def _format_results(self, pmids_and_text : list[dict[str, str]]) -> PubmedResults:
+    filtered_pmid_text_pairs = PubmedResults(pmids_and_text)
+    if self.debug:
+      print("=" * 30)
+      print(filtered_pmid_text_pairs)
+    return filtered_pmid_text_pairs
+  
+  def _rerank(self, user_query : str, pmids_and_text : list[dict[str, str]], top_n : int) -> list[dict[str, str]]:
+    """keeps the top_n candidates by local relevance to the user query"""
+    
+    texts = [pair.get("abstract") or pair.get("full-text") or "" for pair in pmids_and_text]
+    ranked = self.reranker.top(user_query, texts, top_n)
+    if self.debug:
+      print("=" * 30)
+      print(f"in _rerank, kept {[(pmids_and_text[i]['pmid'], round(score, 3)) for i, score in ranked]} of {len(texts)} candidates")
+      print("=" * 30)
+    return [pmids_and_text[i] for i, _ in ranked]
+  
+  def _llm_filter(self, user_query : str, pmids_and_text : list[dict[str, str]]) -> list[dict[str, str]]:
+    """asks decider_agent which candidates are relevant, keeps every candidate if its answer can't be parsed"""
+    
+    llm_chain = self._llm_filter_chain()
+    response = llm_chain.invoke({"user_query": user_query, "pmids_and_text": pmids_and_text}).content
+    return self._keep_filtered(response, pmids_and_text)
+  
+  def _llm_filter_chain(self):
     system_prompt = """
       You are a professional decision maker given a set of pmids and texts. Please determine which pmids and their associated text are relevant to 
       the user query at hand.
@@ -51,37 +184,29 @@ class PubmedAPI():
       ("human", human_prompt)
     ])
     
-    llm_chain = prompt | self.decider_agent
+    return prompt | self.decider_agent
+  
+  def _keep_filtered(self, response, pmids_and_text : list[dict[str, str]]) -> list[dict[str, str]]:
+    """candidates whose pmid the decider kept"""
     
-    kept_pmids = llm_chain.invoke({"user_query": user_query, "pmids_and_text": pmids_and_text}).content
     if self.debug:
       print("=" * 30)
-      print(f"In search, kept_pmids.content: {kept_pmids}")
+      print(f"In search, kept_pmids.content: {response}")
       print("=" * 30)
     
-    filtered_pmid_text_pairs = [pair for pair in pmids_and_text if pair["pmid"] in kept_pmids]
-    filtered_pmid_text_pairs = str(filtered_pmid_text_pairs).replace('{', "").replace('}', "")
-    if self.debug:
-      print("=" * 30)
-      print(filtered_pmid_text_pairs)
-    return filtered_pmid_text_pairs
+    kept_pmids = _parse_pmids(response)
+    if kept_pmids is None:
+      if self.debug:
+        print("in _llm_filter, could not parse the decider response, keeping the reranked candidates")
+      return pmids_and_text
+    return [pair for pair in pmids_and_text if pair["pmid"] in kept_pmids]
   
   
   def _fetch_abstracts(self, user_query : str, number_to_retrieve : int) -> list[dict[str, str]]:
     """fetches abstracts from pubmed using Entrez"""
     
-    if (number_to_retrieve > 15):
-      raise ValueError(f'number_to_retrieve with value {number_to_retrieve} is quite high, 15 is reasonable limit to maintain context.')
-    
     pmids = self._fetch_pmids(user_query, number_to_retrieve)
-    
-    pmid_and_abstracts = []
-    for pmid in pmids:
-      abstract_handle = Entrez.efetch(db="pubmed", id=pmid, rettype="abstract", retmode="xml")
-      xml_data = abstract_handle.read()
-      root = ET.fromstring(xml_data)
-      for abstract_part in root.findall(".//Abstract"):
-        pmid_and_abstracts.append({"pmid": pmid, "abstract": self._get_element_text(abstract_part)})
+    pmid_and_abstracts = self._fetch_abstracts_by_pmid(pmids)
     
     if self.debug:
       print("=" * 30)
@@ -90,6 +215,64 @@ class PubmedAPI():
       
     return pmid_and_abstracts
   
+  def _fetch_abstracts_by_pmid(self, pmids: list[str]) -> list[dict[str, str]]:
+    """fetches abstracts with one batched efetch per efetch_batch_size pmids, batches run concurrently, 
+    cached pmids are not fetched again"""
+    
+    abstracts_by_pmid, batches = self._cached_abstracts(pmids)
+    if len(batches) <= 1:
+      results = [self._efetch_abstract_batch(batch) for batch in batches]
+    else:
+      with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+        results = list(executor.map(self._efetch_abstract_batch, batches))
+    return self._store_abstracts(pmids, abstracts_by_pmid, batches, results)
+  
+  def _cached_abstracts(self, pmids: list[str]) -> tuple[dict[str, list[str]], list[list[str]]]:
+    """cached abstracts by pmid and the efetch batches of uncached pmids"""
+    
+    abstracts_by_pmid: dict[str, list[str]] = {}
+    if self.cache is not None:
+      cached = self.cache.get_articles(pmids, "abstract")
+      abstracts_by_pmid = {pmid: json.loads(content) for pmid, content in cached.items()}
+    missing = [pmid for pmid in pmids if pmid not in abstracts_by_pmid]
+    return abstracts_by_pmid, [missing[i:i + self.efetch_batch_size] for i in range(0, len(missing), self.efetch_batch_size)]
+  
+  def _store_abstracts(self, 
+                       pmids: list[str], 
+                       abstracts_by_pmid: dict[str, list[str]], 
+                       batches: list[list[str]], 
+                       results: list[list[tuple[str, str]]]) -> list[dict[str, str]]:
+    """caches the fetched batches and returns every pmid's abstracts in esearch order"""
+    
+    missing = [pmid for batch in batches for pmid in batch]
+    fetched: dict[str, list[str]] = {pmid: [] for pmid in missing}
+    for result in results:
+      for pmid, abstract in result:
+        fetched.setdefault(pmid, []).append(abstract)
+    abstracts_by_pmid.update(fetched)
+    if self.cache is not None:
+      self.cache.put_articles("abstract", {pmid: json.dumps(abstracts) for pmid, abstracts in fetched.items()})
+    #keep the esearch relevance order
+    return [{"pmid": pmid, "abstract": abstract} for pmid in pmids for abstract in abstracts_by_pmid.get(pmid, [])]
+  
+  def _efetch_abstract_batch(self, pmids: list[str]) -> list[tuple[str, str]]:
+    """one efetch round trip for a batch of pmids, split back per PubmedArticle"""
+    
+    self.rate_limiter.acquire()
+    abstract_handle = Entrez.efetch(db="pubmed", id=",".join(pmids), rettype="abstract", retmode="xml")
+    return self._parse_abstracts(abstract_handle.read())
+  
+  def _parse_abstracts(self, xml_data: bytes) -> list[tuple[str, str]]:
+    root = ET.fromstring(xml_data)
+    pmid_and_abstracts = []
+    for article in root.iter("PubmedArticle"):
+      pmid = article.findtext("MedlineCitation/PMID")
+      if not pmid:
+        continue
+      for abstract_part in article.findall(".//Abstract"):
+        pmid_and_abstracts.append((pmid, self._get_element_text(abstract_part)))
+    return pmid_and_abstracts
+  
   def _get_element_text(self, elem):
     """Recursively extract all text from an ElementTree element."""
     text_parts = []
@@ -101,16 +284,29 @@ class PubmedAPI():
             text_parts.append(child.tail)
     return "".join(text_parts)
 	
-  def _fetch_fulltext(self, user_query : str, number_to_retrieve : int):
-    """fetches available full-text articles from pmc using Entrez"""
+  def _fetch_fulltext(self, user_query : str, number_to_retrieve : int, candidate_count : Optional[int] = None):
+    """fetches available full-text articles from pmc using Entrez as plain text sections, pmids without a pmc copy 
+    are skipped. With a candidate_count over number_to_retrieve the pmc candidates are reranked on their abstracts 
+    first, so only the kept number_to_retrieve articles are downloaded and parsed"""
     
-    pmids = self._fetch_pmids(user_query, number_to_retrieve)
-    pmids_and_papers = []
-    for pmid in pmids:
-      pmcid = self._convert_pmid_pmcid(pmid)
-      paper_handle = Entrez.efetch(db="pmc", id=pmcid, retmode="xml")
-      xml_data = paper_handle.read()
-      pmids_and_papers.append({"pmid": pmid, "full-text": xml_data})
+    pmids = self._fetch_pmids(user_query, candidate_count or number_to_retrieve)
+    pmcids = self._convert_pmids_pmcids(pmids)
+    if self.debug:
+      print(f"in _fetch_fulltext, no pmc copy for {[pmid for pmid in pmids if pmid not in pmcids]}")
+    pmids = [pmid for pmid in pmids if pmid in pmcids]
+    if len(pmids) > number_to_retrieve:
+      ranked = self._rerank(user_query, self._fetch_abstracts_by_pmid(pmids), number_to_retrieve)
+      pmids = _keep_ranked(pmids, ranked, number_to_retrieve)
+    kind = self._fulltext_kind()
+    papers = self.cache.get_articles(pmids, kind) if self.cache is not None else {}
+    available = [pmid for pmid in pmids if pmid not in papers]
+    
+    with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+      fetched = dict(zip(available, executor.map(lambda pmid: self._efetch_pmc(pmcids[pmid]), available)))
+    if self.cache is not None:
+      self.cache.put_articles(kind, fetched)
+    papers.update(fetched)
+    pmids_and_papers = [{"pmid": pmid, "full-text": papers[pmid]} for pmid in pmids if pmid in papers]
     
     if self.debug:
       print("=" * 30)
@@ -118,15 +314,37 @@ class PubmedAPI():
       print("=" * 30)
       
     return pmids_and_papers
+  
+  def _fulltext_kind(self) -> str:
+    #the section selection is part of the key so differently configured instances don't share parsed text
+    return f"fulltext:{','.join(self.fulltext_sections)};{','.join(self.body_sections or ())};{self.fulltext_max_chars or ''}"
+  
+  def _efetch_pmc(self, pmcid: str) -> str:
+    """fetches one pmc article and parses the xml as it streams in, keeping only the configured sections"""
+    
+    self.rate_limiter.acquire()
+    paper_handle = Entrez.efetch(db="pmc", id=pmcid, retmode="xml")
+    try:
+      return extract_pmc_text(paper_handle, self.fulltext_sections, self.body_sections, self.fulltext_max_chars)
+    finally:
+      paper_handle.close()
 
   def _fetch_pmids(self, user_query : str, number_to_retrieve : int) -> list[str]:
-    """fetches pmids from pubmed using Entrez"""
+    """fetches pmids from pubmed using Entrez, recent results for the same term come from the cache"""
+    
+    if self.cache is not None:
+      cached_ids = self.cache.get_search(user_query, number_to_retrieve)
+      if cached_ids is not None:
+        return cached_ids
     
+    self.rate_limiter.acquire()
     handle = Entrez.esearch(db="pubmed", retmax=number_to_retrieve, term=user_query)
     record = Entrez.read(handle)
     print(record)
     if isinstance(record, dict):
-      ids = record['IdList']
+      ids = [str(pmid) for pmid in record['IdList']]
+      if self.cache is not None:
+        self.cache.put_search(user_query, number_to_retrieve, ids)
       if self.debug:
         print("=" * 30)
         print(user_query)
@@ -139,20 +357,147 @@ class PubmedAPI():
     raise TypeError(f"in fetch_pmids, expected a dict, got {type(record).__name__}")
 
 
-  def _convert_pmid_pmcid(self, pmid : str) -> str:
-    """converts a pmid to pmcid, allowing querying of pmc database"""
-    
-    url = f"https://www.ncbi.nlm.nih.gov/pmc/utils/idconv/v1.0/?ids={pmid}&format=json"
-    response = requests.get(url)
-    data = response.json()
-    pmcids = data["records"][0].get("pmcid")
-    if pmcids:
-      if self.debug:
-        print("=" * 30)
-        print(f"in _convert_pmid_pmcid, pmcids: {pmcids}")
-        print("=" * 30)
-      return pmcids
-    raise ValueError(f"in _convert_pmid_pmcid, expected pmcids but got none")
+  def _convert_pmids_pmcids(self, pmids : list[str]) -> dict[str, str]:
+    """converts pmids to pmcids with one idconv call per 200 uncached ids, pmids without a pmc copy are left out"""
+    
+    pmcids = self.cache.get_articles(pmids, "pmcid") if self.cache is not None else {}
+    missing = [pmid for pmid in pmids if pmid not in pmcids]
+    fetched = {}
+    for i in range(0, len(missing), IDCONV_BATCH_SIZE):
+      self.rate_limiter.acquire()
+      response = self.http.get(IDCONV_URL, params={
+        "ids": ",".join(missing[i:i + IDCONV_BATCH_SIZE]),
+        "format": "json",
+        "tool": "vaxchat",
+        "email": self.email,
+      }, timeout=30)
+      response.raise_for_status()
+      for record in response.json().get("records", []):
+        if record.get("pmcid"):
+          fetched[str(record["pmid"])] = record["pmcid"]
+    if self.cache is not None:
+      self.cache.put_articles("pmcid", fetched)
+    pmcids.update(fetched)
+    
+    if self.debug:
+      print("=" * 30)
+      print(f"in _convert_pmids_pmcids, pmcids: {pmcids}")
+      print("=" * 30)
+    return pmcids
+	
+  def _async_http(self) -> httpx.AsyncClient:
+    if self.ahttp is None:
+      self.ahttp = httpx.AsyncClient(timeout=30, limits=httpx.Limits(max_connections=self.max_workers))
+    return self.ahttp
+  
+  def _eutils_params(self) -> dict[str, str]:
+    params = {"tool": "vaxchat", "email": self.email}
+    if self.api_key:
+      params["api_key"] = self.api_key
+    return params
+  
+  async def _afetch_pmids(self, user_query : str, number_to_retrieve : int) -> list[str]:
+    """_fetch_pmids through esearch's json endpoint, sqlite cache reads and writes run in worker threads"""
+    
+    if self.cache is not None:
+      cached_ids = await asyncio.to_thread(self.cache.get_search, user_query, number_to_retrieve)
+      if cached_ids is not None:
+        return cached_ids
+    
+    await self.rate_limiter.aacquire()
+    response = await self._async_http().get(ESEARCH_URL, params={
+      "db": "pubmed", 
+      "term": user_query, 
+      "retmax": number_to_retrieve, 
+      "retmode": "json", 
+      **self._eutils_params(),
+    })
+    response.raise_for_status()
+    ids = [str(pmid) for pmid in response.json()["esearchresult"]["idlist"]]
+    if self.cache is not None:
+      await asyncio.to_thread(self.cache.put_search, user_query, number_to_retrieve, ids)
+    if self.debug:
+      print(f"in _afetch_pmids, id_list {ids}")
+    return ids
+  
+  async def _afetch_abstracts(self, user_query : str, number_to_retrieve : int) -> list[dict[str, str]]:
+    pmids = await self._afetch_pmids(user_query, number_to_retrieve)
+    return await self._afetch_abstracts_by_pmid(pmids)
+  
+  async def _afetch_abstracts_by_pmid(self, pmids: list[str]) -> list[dict[str, str]]:
+    abstracts_by_pmid, batches = await asyncio.to_thread(self._cached_abstracts, pmids)
+    results = await asyncio.gather(*(self._aefetch_abstract_batch(batch) for batch in batches))
+    return await asyncio.to_thread(self._store_abstracts, pmids, abstracts_by_pmid, batches, list(results))
+  
+  async def _aefetch_abstract_batch(self, pmids: list[str]) -> list[tuple[str, str]]:
+    await self.rate_limiter.aacquire()
+    response = await self._async_http().post(EFETCH_URL, data={
+      "db": "pubmed", 
+      "id": ",".join(pmids), 
+      "rettype": "abstract", 
+      "retmode": "xml", 
+      **self._eutils_params(),
+    })
+    response.raise_for_status()
+    return await asyncio.to_thread(self._parse_abstracts, response.content)
+  
+  async def _afetch_fulltext(self, 
+                             user_query : str, 
+                             number_to_retrieve : int, 
+                             candidate_count : Optional[int] = None) -> list[dict[str, str]]:
+    pmids = await self._afetch_pmids(user_query, candidate_count or number_to_retrieve)
+    pmcids = await self._aconvert_pmids_pmcids(pmids)
+    pmids = [pmid for pmid in pmids if pmid in pmcids]
+    if len(pmids) > number_to_retrieve:
+      candidates = await self._afetch_abstracts_by_pmid(pmids)
+      ranked = await asyncio.to_thread(self._rerank, user_query, candidates, number_to_retrieve)
+      pmids = _keep_ranked(pmids, ranked, number_to_retrieve)
+    kind = self._fulltext_kind()
+    papers = await asyncio.to_thread(self.cache.get_articles, pmids, kind) if self.cache is not None else {}
+    available = [pmid for pmid in pmids if pmid not in papers]
+    
+    texts = await asyncio.gather(*(self._aefetch_pmc(pmcids[pmid]) for pmid in available))
+    fetched = dict(zip(available, texts))
+    if self.cache is not None:
+      await asyncio.to_thread(self.cache.put_articles, kind, fetched)
+    papers.update(fetched)
+    return [{"pmid": pmid, "full-text": papers[pmid]} for pmid in pmids if pmid in papers]
+  
+  async def _aefetch_pmc(self, pmcid: str) -> str:
+    await self.rate_limiter.aacquire()
+    response = await self._async_http().get(EFETCH_URL, params={"db": "pmc", "id": pmcid, "retmode": "xml", **self._eutils_params()})
+    response.raise_for_status()
+    #iterparse over a whole article is cpu bound
+    return await asyncio.to_thread(extract_pmc_text, response.content, self.fulltext_sections, self.body_sections, 
+                                   self.fulltext_max_chars)
+  
+  async def _aconvert_pmids_pmcids(self, pmids : list[str]) -> dict[str, str]:
+    pmcids = await asyncio.to_thread(self.cache.get_articles, pmids, "pmcid") if self.cache is not None else {}
+    missing = [pmid for pmid in pmids if pmid not in pmcids]
+    fetched = {}
+    for i in range(0, len(missing), IDCONV_BATCH_SIZE):
+      await self.rate_limiter.aacquire()
+      response = await self._async_http().get(IDCONV_URL, params={
+        "ids": ",".join(missing[i:i + IDCONV_BATCH_SIZE]),
+        "format": "json",
+        "tool": "vaxchat",
+        "email": self.email,
+      })
+      response.raise_for_status()
+      for record in response.json().get("records", []):
+        if record.get("pmcid"):
+          fetched[str(record["pmid"])] = record["pmcid"]
+    if self.cache is not None:
+      await asyncio.to_thread(self.cache.put_articles, "pmcid", fetched)
+    pmcids.update(fetched)
+    return pmcids
+  
+  async def aclose(self) -> None:
+    """closes the async http client, call it from the event loop that used it"""
+    
+    if self.ahttp is not None:
+      await self.ahttp.aclose()
+      self.ahttp = None
 	
   def _rephrase_user_query(self, user_query: str) -> str:
     """Usings helper_agent to rephrase a user query into a searchable keyword string"""
@@ -184,6 +529,31 @@ class PubmedAPI():
 
  
  
+def _keep_ranked(pmids: list[str], ranked: list[dict[str, str]], number_to_retrieve: int) -> list[str]:
+  """the reranked pmids, topped up in esearch order with candidates that had no abstract to rank"""
+  
+  kept = list(dict.fromkeys(pair["pmid"] for pair in ranked))
+  kept += [pmid for pmid in pmids if pmid not in kept]
+  return kept[:number_to_retrieve]
+
+
+def _parse_pmids(response) -> Optional[set[str]]:
+  """pmids from the decider's {"pmids": [...]} answer, tolerating code fences around the json, None if unparsable"""
+  
+  if not isinstance(response, str):
+    return None
+  match = re.search(r"\{.*\}", response, re.DOTALL)
+  if match is None:
+    return None
+  try:
+    pmids = json.loads(match.group(0)).get("pmids")
+  except (json.JSONDecodeError, AttributeError):
+    return None
+  if not isinstance(pmids, list):
+    return None
+  return {str(pmid).strip() for pmid in pmids}
+
+
 def connect_pubmed(email : str, debug : bool) -> PubmedAPI:
   """Creates PubmedAPI object"""
   return PubmedAPI(email, debug)
\ No newline at end of file
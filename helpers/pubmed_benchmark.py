@@ -0,0 +1,102 @@
+import argparse
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+sys.path.append("../")
+
+from Bio import Entrez
+import helpers.pubmed as pubmed
+
+NCBI_HOST = "https://eutils.ncbi.nlm.nih.gov"
+
+
+class MockEntrezHandler(BaseHTTPRequestHandler):
+  """Answers efetch with one PubmedArticle per requested id after a fixed latency"""
+
+  latency: float = 0.2
+
+  def do_GET(self):
+    self._respond(parse_qs(urlsplit(self.path).query))
+
+  def do_POST(self):
+    body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode()
+    self._respond(parse_qs(body))
+
+  def _respond(self, params):
+    time.sleep(self.latency)
+    ids = params.get("id", [""])[0].split(",")
+    articles = "".join(
+      f"<PubmedArticle><MedlineCitation><PMID>{pmid}</PMID><Article><Abstract>"
+      f"<AbstractText>Mock abstract for {pmid}.</AbstractText></Abstract></Article></MedlineCitation></PubmedArticle>"
+      for pmid in ids)
+    payload = f"<?xml version=\"1.0\"?><PubmedArticleSet>{articles}</PubmedArticleSet>".encode()
+    self.send_response(200)
+    self.send_header("Content-Type", "text/xml")
+    self.send_header("Content-Length", str(len(payload)))
+    self.end_headers()
+    self.wfile.write(payload)
+
+  def log_message(self, *args):
+    pass
+
+
+def redirect_entrez(port: int) -> None:
+  """points Bio.Entrez at the mock server instead of NCBI"""
+
+  urlopen = Entrez.urlopen
+
+  def local_urlopen(request, *args, **kwargs):
+    request.full_url = request.full_url.replace(NCBI_HOST, f"http://127.0.0.1:{port}")
+    return urlopen(request, *args, **kwargs)
+
+  Entrez.urlopen = local_urlopen
+
+
+def serial_fetch(pmids: list[str]) -> int:
+  """the previous behavior, one efetch round trip per pmid"""
+
+  count = 0
+  for pmid in pmids:
+    handle = Entrez.efetch(db="pubmed", id=pmid, rettype="abstract", retmode="xml")
+    handle.read()
+    count += 1
+  return count
+
+
+def main():
+  parser = argparse.ArgumentParser(description="serial vs batched PubMed abstract fetching against a local mock Entrez")
+  parser.add_argument("--pmids", type=int, default=10)
+  parser.add_argument("--latency", type=float, default=0.2, help="seconds the mock server waits per request")
+  parser.add_argument("--batch-size", type=int, default=200)
+  args = parser.parse_args()
+
+  MockEntrezHandler.latency = args.latency
+  server = ThreadingHTTPServer(("127.0.0.1", 0), MockEntrezHandler)
+  threading.Thread(target=server.serve_forever, daemon=True).start()
+  redirect_entrez(server.server_address[1])
+
+  #the benchmark never reaches the llm filter
+  pubmed.create_llm = lambda *args, **kwargs: None
+  api = pubmed.PubmedAPI("benchmark@example.com", efetch_batch_size=args.batch_size, use_cache=False)
+  pmids = [str(30000000 + i) for i in range(args.pmids)]
+
+  start = time.perf_counter()
+  serial_fetch(pmids)
+  serial_seconds = time.perf_counter() - start
+
+  start = time.perf_counter()
+  abstracts = api._fetch_abstracts_by_pmid(pmids)
+  batched_seconds = time.perf_counter() - start
+  server.shutdown()
+
+  print(f"{args.pmids} pmids, {args.latency:.2f}s mock latency")
+  print(f"serial : {serial_seconds:.2f}s")
+  print(f"batched: {batched_seconds:.2f}s ({len(abstracts)} abstracts)")
+  print(f"speedup: {serial_seconds / batched_seconds:.1f}x")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,170 @@
+from pathlib import Path
+from typing import Optional, Union
+import json
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS articles (
+  pmid TEXT NOT NULL,
+  kind TEXT NOT NULL,
+  content BLOB NOT NULL,
+  size INTEGER NOT NULL,
+  accessed REAL NOT NULL,
+  PRIMARY KEY (pmid, kind)
+);
+CREATE TABLE IF NOT EXISTS searches (
+  key TEXT PRIMARY KEY,
+  pmids TEXT NOT NULL,
+  size INTEGER NOT NULL,
+  created REAL NOT NULL,
+  accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS articles_accessed ON articles (accessed);
+CREATE INDEX IF NOT EXISTS searches_accessed ON searches (accessed);
+"""
+
+
+def normalize_term(term: str) -> str:
+  """esearch terms that only differ in case or spacing share a cache entry"""
+
+  return " ".join(term.casefold().split())
+
+
+class PubmedCache:
+  """On-disk SQLite cache for esearch results (with a TTL) and article content keyed by pmid (no TTL, articles don't change)"""
+
+  def __init__(self,
+               path: str = "../helpers/data/pubmed_cache.sqlite3",
+               max_bytes: int = 512 * 1024 * 1024,
+               search_ttl: float = 24 * 3600) -> None:
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    self.path: str = path
+    self.max_bytes: int = max_bytes
+    self.search_ttl: float = search_ttl
+    self._lock = threading.Lock()
+    self._connection = sqlite3.connect(path, check_same_thread=False)
+    #WAL lets several backend processes read while one writes
+    self._connection.execute("PRAGMA journal_mode=WAL")
+    self._connection.executescript(SCHEMA)
+    self.counts = {"search_hits": 0, "search_misses": 0, "article_hits": 0, "article_misses": 0, "evictions": 0}
+
+  def get_search(self, term: str, retmax: int) -> Optional[list[str]]:
+    """cached pmids for an esearch term, None when missing or older than search_ttl"""
+
+    key = f"{normalize_term(term)}|{retmax}"
+    now = time.time()
+    with self._lock:
+      row = self._connection.execute("SELECT pmids, created FROM searches WHERE key = ?", (key,)).fetchone()
+      if row is None or now - row[1] > self.search_ttl:
+        self.counts["search_misses"] += 1
+        return None
+      self._connection.execute("UPDATE searches SET accessed = ? WHERE key = ?", (now, key))
+      self._connection.commit()
+      self.counts["search_hits"] += 1
+    return json.loads(row[0])
+
+  def put_search(self, term: str, retmax: int, pmids: list[str]) -> None:
+    """stores the pmids an esearch returned"""
+
+    key = f"{normalize_term(term)}|{retmax}"
+    payload = json.dumps(pmids)
+    now = time.time()
+    with self._lock:
+      self._connection.execute(
+        "INSERT OR REPLACE INTO searches (key, pmids, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+        (key, payload, len(payload), now, now))
+      self._connection.commit()
+    self._evict()
+
+  def get_articles(self, pmids: list[str], kind: str) -> dict[str, Union[str, bytes]]:
+    """cached content of kind ("abstract", "fulltext", "pmcid", ...) for the pmids that have it"""
+
+    if not pmids:
+      return {}
+    now = time.time()
+    placeholders = ",".join("?" * len(pmids))
+    with self._lock:
+      rows = self._connection.execute(
+        f"SELECT pmid, content FROM articles WHERE kind = ? AND pmid IN ({placeholders})", (kind, *pmids)).fetchall()
+      if rows:
+        self._connection.executemany(
+          "UPDATE articles SET accessed = ? WHERE pmid = ? AND kind = ?", [(now, pmid, kind) for pmid, _ in rows])
+        self._connection.commit()
+      self.counts["article_hits"] += len(rows)
+      self.counts["article_misses"] += len(set(pmids)) - len(rows)
+    return {pmid: content for pmid, content in rows}
+
+  def put_articles(self, kind: str, contents: dict[str, Union[str, bytes]]) -> None:
+    """stores article content of kind by pmid"""
+
+    if not contents:
+      return
+    now = time.time()
+    rows = [(pmid, kind, content, len(content), now) for pmid, content in contents.items()]
+    with self._lock:
+      self._connection.executemany(
+        "INSERT OR REPLACE INTO articles (pmid, kind, content, size, accessed) VALUES (?, ?, ?, ?, ?)", rows)
+      self._connection.commit()
+    self._evict()
+
+  def size_bytes(self) -> int:
+    """bytes of cached content across both tables"""
+
+    with self._lock:
+      return self._size_bytes()
+
+  def stats(self) -> dict[str, float]:
+    """hit/miss counters, entry counts and stored bytes"""
+
+    with self._lock:
+      articles = self._connection.execute("SELECT COUNT(*) FROM articles").fetchone()[0]
+      searches = self._connection.execute("SELECT COUNT(*) FROM searches").fetchone()[0]
+      size = self._size_bytes()
+    lookups = sum(self.counts[key] for key in ("search_hits", "search_misses", "article_hits", "article_misses"))
+    hits = self.counts["search_hits"] + self.counts["article_hits"]
+    return {
+      **self.counts,
+      "articles": articles,
+      "searches": searches,
+      "bytes": size,
+      "max_bytes": self.max_bytes,
+      "hit_rate": hits / lookups if lookups else 0.0,
+    }
+
+  def clear(self) -> None:
+    """drops every cached search and article"""
+
+    with self._lock:
+      self._connection.execute("DELETE FROM articles")
+      self._connection.execute("DELETE FROM searches")
+      self._connection.commit()
+
+  def _size_bytes(self) -> int:
+    articles = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM articles").fetchone()[0]
+    searches = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM searches").fetchone()[0]
+    return articles + searches
+
+  def _evict(self) -> None:
+    """drops least recently used entries until the cache is back under 90% of max_bytes"""
+
+    with self._lock:
+      size = self._size_bytes()
+      if size <= self.max_bytes:
+        return
+      target = self.max_bytes * 0.9
+      rows = self._connection.execute(
+        "SELECT 'articles', pmid || '|' || kind, size, accessed FROM articles "
+        "UNION ALL SELECT 'searches', key, size, accessed FROM searches ORDER BY accessed").fetchall()
+      for table, key, entry_size, _ in rows:
+        if size <= target:
+          break
+        if table == "articles":
+          pmid, kind = key.rsplit("|", 1)
+          self._connection.execute("DELETE FROM articles WHERE pmid = ? AND kind = ?", (pmid, kind))
+        else:
+          self._connection.execute("DELETE FROM searches WHERE key = ?", (key,))
+        size -= entry_size
+        self.counts["evictions"] += 1
+      self._connection.commit()
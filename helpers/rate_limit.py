@@ -0,0 +1,57 @@
+from typing import Optional
+import asyncio
+import threading
+import time
+
+
+class TokenBucket:
+  """Thread-safe token bucket, acquire() blocks until a request may be sent"""
+
+  def __init__(self, rate: float, capacity: float = 1.0) -> None:
+    if rate <= 0:
+      raise ValueError(f"in TokenBucket, expected rate > 0 but got {rate}")
+    self.rate: float = rate
+    self.capacity: float = capacity
+    self.tokens: float = capacity
+    self.updated: float = time.monotonic()
+    self._lock = threading.Lock()
+
+  def acquire(self, tokens: float = 1.0) -> float:
+    """takes tokens, sleeping until they are available, and returns the seconds waited"""
+
+    waited = 0.0
+    while True:
+      wait = self._take(tokens)
+      if wait == 0.0:
+        return waited
+      time.sleep(wait)
+      waited += wait
+
+  async def aacquire(self, tokens: float = 1.0) -> float:
+    """acquire for coroutines, waits without blocking the event loop. Shares the bucket with acquire"""
+
+    waited = 0.0
+    while True:
+      wait = self._take(tokens)
+      if wait == 0.0:
+        return waited
+      await asyncio.sleep(wait)
+      waited += wait
+
+  def _take(self, tokens: float) -> float:
+    """takes tokens and returns 0.0, or returns the seconds until enough tokens are available"""
+
+    with self._lock:
+      now = time.monotonic()
+      self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+      self.updated = now
+      if self.tokens >= tokens:
+        self.tokens -= tokens
+        return 0.0
+      return (tokens - self.tokens) / self.rate
+
+
+def ncbi_rate(api_key: Optional[str]) -> float:
+  """NCBI E-utilities allow 3 requests/second, or 10 with an api key"""
+
+  return 10.0 if api_key else 3.0
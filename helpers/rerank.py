@@ -0,0 +1,68 @@
+from embed_create.model_registry import get_model
+from typing import Literal
+from collections import Counter
+import math
+import re
+
+_TOKEN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> list[str]:
+  """lowercased word tokens"""
+
+  return _TOKEN.findall(text.casefold())
+
+
+def bm25_scores(query: str, documents: list[str], k1: float = 1.5, b: float = 0.75) -> list[float]:
+  """Okapi BM25 score of every document against the query"""
+
+  tokenized = [tokenize(document) for document in documents]
+  if not tokenized:
+    return []
+  average_length = sum(len(tokens) for tokens in tokenized) / len(tokenized) or 1.0
+  document_frequency = Counter(term for tokens in tokenized for term in set(tokens))
+  query_terms = set(tokenize(query))
+
+  scores = []
+  for tokens in tokenized:
+    counts = Counter(tokens)
+    score = 0.0
+    for term in query_terms:
+      if term not in counts:
+        continue
+      idf = math.log(1 + (len(tokenized) - document_frequency[term] + 0.5) / (document_frequency[term] + 0.5))
+      frequency = counts[term]
+      score += idf * frequency * (k1 + 1) / (frequency + k1 * (1 - b + b * len(tokens) / average_length))
+    scores.append(score)
+  return scores
+
+
+class Reranker:
+  """Scores candidate texts against a query locally, either with the shared sentence-transformer (cosine similarity)
+  or with BM25 when no model should be loaded"""
+
+  def __init__(self, method: Literal["embedding", "bm25"] = "embedding", model_name: str = "all-MiniLM-L6-v2") -> None:
+    if method not in ("embedding", "bm25"):
+      raise ValueError(f'in Reranker, method with value {method} is invalid, must be "embedding" or "bm25"')
+    self.method = method
+    self.model_name = model_name
+
+  def scores(self, query: str, documents: list[str]) -> list[float]:
+    """relevance score of every document, higher is more relevant"""
+
+    if not documents:
+      return []
+    if self.method == "bm25":
+      return bm25_scores(query, documents)
+
+    #the encoder truncates long texts, for full texts that leaves the title and abstract which is what we want to score
+    model = get_model(self.model_name)
+    vectors = model.encode([query] + documents, convert_to_numpy=True, normalize_embeddings=True)
+    return [float(score) for score in vectors[1:] @ vectors[0]]
+
+  def top(self, query: str, documents: list[str], top_n: int) -> list[tuple[int, float]]:
+    """(index, score) of the top_n documents, best first"""
+
+    scores = self.scores(query, documents)
+    order = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)
+    return [(i, scores[i]) for i in order[:top_n]]
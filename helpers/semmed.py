@@ -1,14 +1,59 @@
+from helpers.graph_query import GraphQueryRunner, QueryRejected
+
 from langchain_core.prompts import ChatPromptTemplate
-import neo4j
 
 class SemmedAPI():
-  def __init__(self, neo4j_driver, helper, debug: bool):
+  def __init__(self, neo4j_driver, helper, debug: bool, async_neo4j_driver=None):
     self.neo4j_driver = neo4j_driver
+    self.async_neo4j_driver = async_neo4j_driver
+    self.graph = GraphQueryRunner(neo4j_driver, async_neo4j_driver, "semmed")
     self.helper = helper
     self.debug = debug
     
   def retrieve(self, user_query: str, k: int):
     """Converts user query into cypher and retrieves k triples"""
+    llm_chain = self._cypher_chain(user_query, k)
+    final_response = llm_chain.invoke({"user_query": user_query, "k": k, "feedback": ""}).content
+    if self.debug:
+      print(final_response)
+    
+    try:
+      results = self.graph.run(str(final_response))
+    except QueryRejected as e:
+      #one rewrite with the plan check's feedback, a second rejection returns nothing rather than failing the answer
+      print(e)
+      final_response = llm_chain.invoke({"user_query": user_query, "k": k, "feedback": e.prompt_hint}).content
+      try:
+        results = self.graph.run(str(final_response))
+      except QueryRejected as e:
+        print(e)
+        return []
+    if self.debug:
+      print(results)
+    return results
+  
+  async def aretrieve(self, user_query: str, k: int):
+    """retrieve with an awaited llm call and the async neo4j driver"""
+    llm_chain = self._cypher_chain(user_query, k)
+    final_response = (await llm_chain.ainvoke({"user_query": user_query, "k": k, "feedback": ""})).content
+    if self.debug:
+      print(final_response)
+    
+    try:
+      results = await self.graph.arun(str(final_response))
+    except QueryRejected as e:
+      print(e)
+      final_response = (await llm_chain.ainvoke({"user_query": user_query, "k": k, "feedback": e.prompt_hint})).content
+      try:
+        results = await self.graph.arun(str(final_response))
+      except QueryRejected as e:
+        print(e)
+        return []
+    if self.debug:
+      print(results)
+    return results
+  
+  def _cypher_chain(self, user_query: str, k: int):
     system_prompt = """
     You are a professional cypher expert, converting user queries into cypher. You will be provided
     a user query, please convert it into a cypher query. Your limit should be k which will also 
@@ -37,28 +82,14 @@ class SemmedAPI():
     Your response must be **strictly string** containing only the cyper query:
     """
     
-    human_prompt = f"The user query is: {user_query} and the k is: {k}"
+    human_prompt = f"The user query is: {user_query} and the k is: {k}" + "{feedback}"
     
     prompt = ChatPromptTemplate([
       ("system", system_prompt),
       ("human", human_prompt)
     ])
     
-    llm_chain = prompt | self.helper
-    final_response = llm_chain.invoke({"user_query": user_query, "k": k}).content
-    if self.debug:
-      print(final_response)
-    
-    with self.neo4j_driver.session(default_access_mode=neo4j.READ_ACCESS) as session:
-      retrieved_data = session.run(final_response)
-      results = retrieved_data.data()
-      if self.debug:
-        print(results)
-        
-      if results is None:
-        raise ValueError("in SemMedAPI, expected results but got None")
-      else:
-        return results
+    return prompt | self.helper
 
     
   
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+#modules import each other from the repository root, like the backend's sys.path.append("../")
+sys.path.append(str(Path(__file__).resolve().parents[1]))
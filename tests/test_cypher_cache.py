@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("sentence_transformers")
+
+from helpers.cypher_cache import CypherCache
+
+PFIZER_CYPHER = 'MATCH (v:VaccineName) WHERE toLower(v.MANUFACTURER) CONTAINS toLower("Pfizer") RETURN v.NAME LIMIT {}'
+
+
+@pytest.fixture
+def cache(monkeypatch):
+  """a cache whose encoder maps every query to the same vector, so only the reuse guard decides semantic hits"""
+
+  cache = CypherCache(threshold=0.92)
+  monkeypatch.setattr(cache, "_embed", lambda text: np.full(4, 0.5, dtype=np.float32))
+  return cache
+
+
+def test_semantic_hit_requires_the_same_count(cache):
+  cache.store("10 vaccines made by Pfizer", PFIZER_CYPHER.format(10))
+
+  assert cache.lookup("3 vaccines made by Pfizer") is None
+  assert cache.lookup("10 vaccines manufactured by Pfizer") == PFIZER_CYPHER.format(10)
+  assert cache.stats()["rejected"] == 1
+
+
+def test_semantic_hit_requires_the_same_negation(cache):
+  cache.store("vaccines made by Pfizer", PFIZER_CYPHER.format(5))
+
+  assert cache.lookup("vaccines not made by Pfizer") is None
+  assert cache.lookup("vaccines that aren't made by Pfizer") is None
+  assert cache.lookup("which vaccines did Pfizer make") == PFIZER_CYPHER.format(5)
+
+
+def test_semantic_hit_requires_numeric_filter_literals(cache):
+  cache.store("vaccines licensed after 2010", "MATCH (v:VaccineName) WHERE v.YEAR > 2010 RETURN v.NAME LIMIT 5")
+
+  assert cache.lookup("vaccines licensed after 2015") is None
+
+
+def test_evict_drops_every_entry_with_the_rejected_cypher(cache):
+  cache.store("vaccines made by Pfizer", PFIZER_CYPHER.format(5))
+  cache.store("Pfizer vaccines", PFIZER_CYPHER.format(5))
+
+  assert cache.evict(PFIZER_CYPHER.format(5)) == 2
+  assert cache.lookup("which vaccines did Pfizer make") is None
+  assert cache.stats()["evictions"] == 2
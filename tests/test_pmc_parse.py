@@ -0,0 +1,25 @@
+from helpers.pmc_parse import extract_pmc_text
+
+ARTICLE = b"""<article>
+<front><article-meta><title-group><article-title>Brucella vaccines</article-title></title-group>
+<abstract><p>Live attenuated strains protect cattle.</p></abstract></article-meta></front>
+<body><sec><title>Results</title>
+<p>Three strains were compared:<list><list-item><p>S19 is licensed.</p></list-item>
+<list-item><p>RB51 is rough.</p></list-item></list> All induced immunity.</p>
+<p>Rev.1 is used in sheep.</p>
+</sec></body>
+</article>"""
+
+
+def test_nested_list_paragraphs_stay_inside_their_parent():
+  text = extract_pmc_text(ARTICLE)
+
+  assert text == ("Title: Brucella vaccines\n\n"
+                   "Abstract: Live attenuated strains protect cattle.\n\n"
+                   "## Results\n"
+                   "Three strains were compared: S19 is licensed. RB51 is rough. All induced immunity.\n"
+                   "Rev.1 is used in sheep.")
+
+
+def test_max_chars_cuts_the_text():
+  assert len(extract_pmc_text(ARTICLE, max_chars=40)) == 40
@@ -1,13 +1,24 @@
 from tools.tool import Tool
-from drivers.neo4j_drive import connect_neo4j
+from drivers.neo4j_drive import connect_neo4j, connect_neo4j_async
 from helpers.cypher import CypherAPI
 
 class CypherSearch(Tool):
-  def __init__(self, debug : bool, vector_store_names: list[str], cypher_queries: list[str], cypher_query_names: list[str]):
+  def __init__(self, 
+               debug : bool, 
+               vector_store_names: list[str], 
+               cypher_queries: list[str], 
+               cypher_query_names: list[str], 
+               async_driver: bool = False):
     super().__init__("cypher_search")
     self.neo4j_client = connect_neo4j()
-    self.cypher_api = CypherAPI(self.neo4j_client, debug, vector_store_names, cypher_queries, cypher_query_names)
+    #only the asyncio server awaits aexecute, it owns closing the async driver
+    self.cypher_api = CypherAPI(self.neo4j_client, debug, vector_store_names, cypher_queries, cypher_query_names, 
+                                async_neo4j_driver=connect_neo4j_async() if async_driver else None)
     
   def execute(self, *args, **kwargs):
     user_query = kwargs.get("user_query") or args[0]
-    return self.cypher_api.retrieve(user_query)
\ No newline at end of file
+    return self.cypher_api.retrieve(user_query)
+  
+  async def aexecute(self, *args, **kwargs):
+    user_query = kwargs.get("user_query") or args[0]
+    return await self.cypher_api.aretrieve(user_query)
\ No newline at end of file
@@ -3,11 +3,11 @@ from drivers.neo4j_drive import connect_neo4j
 from helpers.embed import EmbedAPI
 
 class EmbedSearch(Tool):
-  def __init__(self, debug: bool):
+  def __init__(self, debug: bool, index_type: str = "flat"):
     super().__init__("embed_search")
     self.debug = debug
     self.neo4j_client = connect_neo4j()
-    self.api_client = EmbedAPI(self.neo4j_client, self.debug)
+    self.api_client = EmbedAPI(self.neo4j_client, self.debug, index_type)
   
   def execute(self, *args, **kwargs):
     user_query = kwargs.get("user_query") or args[0]
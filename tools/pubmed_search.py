@@ -10,4 +10,10 @@ class PubmedSearch(Tool):
     user_query = kwargs.get("user_query") or args[0]
     number_to_retrieve = kwargs.get("number", 5)
     mode = kwargs.get("type", "abstract")
-    return self.api_client.search(user_query, number_to_retrieve, mode)
\ No newline at end of file
+    return self.api_client.search(user_query, number_to_retrieve, mode)
+  
+  async def aexecute(self, *args, **kwargs):
+    user_query = kwargs.get("user_query") or args[0]
+    number_to_retrieve = kwargs.get("number", 5)
+    mode = kwargs.get("type", "abstract")
+    return await self.api_client.asearch(user_query, number_to_retrieve, mode)
\ No newline at end of file
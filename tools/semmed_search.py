@@ -1,18 +1,23 @@
 from tools.tool import Tool
-from drivers.neo4j_drive import connect_neo4j
+from drivers.neo4j_drive import connect_neo4j, connect_neo4j_async
 from helpers.llm import create_llm
 from helpers.semmed import SemmedAPI
 
 class SemmedSearch(Tool):
-  def __init__(self, debug: bool, dotenv_path: str = "../semmed_neo4j.env"):
+  def __init__(self, debug: bool, dotenv_path: str = "../semmed_neo4j.env", async_driver: bool = False):
     super().__init__("semmed_search")
     self.driver = connect_neo4j(dotenv_path)
     self.helper = create_llm()
-    self.semmed_api = SemmedAPI(self.driver, self.helper, debug)
+    self.semmed_api = SemmedAPI(self.driver, self.helper, debug, connect_neo4j_async(dotenv_path) if async_driver else None)
   
   def execute(self, *args, **kwargs):
     user_query = kwargs.get("user_query") or args[0]
     k = kwargs.get("k", 10)
     return self.semmed_api.retrieve(user_query, k)
+  
+  async def aexecute(self, *args, **kwargs):
+    user_query = kwargs.get("user_query") or args[0]
+    k = kwargs.get("k", 10)
+    return await self.semmed_api.aretrieve(user_query, k)
 	
     
\ No newline at end of file
@@ -1,7 +1,13 @@
 
+import asyncio
+
 class Tool:
   def __init__(self, name : str):
     self.name = name
   
   def execute(self, *args, **kwargs):
-    raise NotImplementedError
\ No newline at end of file
+    raise NotImplementedError
+  
+  async def aexecute(self, *args, **kwargs):
+    """async execute, tools without native async io run execute in a worker thread"""
+    return await asyncio.to_thread(self.execute, *args, **kwargs)
\ No newline at end of file